@@ -0,0 +1,72 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+
+
+class ArrayStorage(Mapping):
+    """
+    Compact variable storage for a site. Variables are interned to their topology index,
+    and their values and latest commit times are kept in typed arrays in index order.
+    Reads like the dict it replaces, but variables cannot be added or removed.
+    """
+
+    def __init__(self, topology, variables):
+        self.topology = topology
+        self.indexes = array('q', (topology.index[variable] for variable in variables))  # Sorted topology indexes
+        self.value_array = array('q', (topology.initial_value(variable) for variable in variables))
+        self.commit_time_array = array('q', bytes(8 * len(self.indexes)))  # 0 until a variable is written
+
+    def slot(self, variable):
+        """Returns the position of a variable in the arrays, or -1 if this site does not hold it."""
+        index = self.topology.index.get(variable)
+        if index is None:
+            return -1
+        pos = bisect_left(self.indexes, index)
+        if pos < len(self.indexes) and self.indexes[pos] == index:
+            return pos
+        return -1
+
+    def __getitem__(self, variable):
+        pos = self.slot(variable)
+        if pos < 0:
+            raise KeyError(variable)
+        return self.value_array[pos]
+
+    def __setitem__(self, variable, value):
+        pos = self.slot(variable)
+        if pos < 0:
+            raise KeyError(variable)
+        self.value_array[pos] = value
+
+    def write(self, variable, value, timestamp):
+        """Store a committed value and its commit time."""
+        pos = self.slot(variable)
+        if pos < 0:
+            raise KeyError(variable)
+        self.value_array[pos] = value
+        self.commit_time_array[pos] = timestamp
+
+    def commit_time(self, variable):
+        """Returns the time of the latest write stored for a variable, 0 for its initial value."""
+        pos = self.slot(variable)
+        if pos < 0:
+            raise KeyError(variable)
+        return self.commit_time_array[pos]
+
+    def __contains__(self, variable):
+        return self.slot(variable) >= 0
+
+    def __iter__(self):
+        variables = self.topology.variables
+        for index in self.indexes:
+            yield variables[index - 1]
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def items(self):
+        """Yield (variable, value) pairs in index order, reading the values array in bulk."""
+        return zip(iter(self), self.value_array)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
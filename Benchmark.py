@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from CommandStream import END, NAMES, parse_line, read_commands
+from Driver import DISPATCH
+from Topology import Topology
+from TransactionManager import TransactionManager
+from WorkloadGenerator import add_arguments, generator_from_args
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(sorted_values, p):
+    """ Nearest-rank percentile of an already sorted list """
+    if not sorted_values:
+        return 0
+    rank = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies_ns):
+    """ Count, percentiles and maximum of a list of latencies, in microseconds """
+    values = sorted(latencies_ns)
+    summary = {"count": len(values)}
+    for p in PERCENTILES:
+        summary[f"p{p}_us"] = round(percentile(values, p) / 1000, 2)
+    summary["max_us"] = round(values[-1] / 1000, 2) if values else 0
+    return summary
+
+
+def run_benchmark(commands, topology=None, storage="dict", track_memory=False):
+    """
+    Run parsed (opcode, args) commands through a fresh TransactionManager with its output discarded.
+    Returns a report with throughput, latency percentiles per operation type and for commits and aborts,
+    and peak memory (traced Python allocations if track_memory, otherwise the process peak RSS).
+    """
+    commands = list(commands)  # Parse up front so that parsing is not measured
+    tm = TransactionManager(topology, storage)
+    tm.initialize_sites()
+    latencies = {name: [] for name in NAMES.values()}
+    commit_latencies = []
+    abort_latencies = []
+
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        if track_memory:
+            tracemalloc.start()
+        clock = time.perf_counter_ns
+        start = clock()
+        for opcode, args in commands:
+            # Look the transaction up first, as ending it may retire it
+            txn = tm.transactions.get(args[0]) if opcode == END else None
+            op_start = clock()
+            DISPATCH[opcode](tm, *args)
+            elapsed = clock() - op_start
+            tm.time += 1
+            latencies[NAMES[opcode]].append(elapsed)
+            if opcode == END:
+                if txn is not None and txn.status == "committed":
+                    commit_latencies.append(elapsed)
+                elif txn is not None and txn.is_aborted():
+                    abort_latencies.append(elapsed)
+        tm.flush_commits()  # Apply the last group of commits
+        total_ns = clock() - start
+        if track_memory:
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    seconds = total_ns / 1e9
+    report = {
+        "operations": len(commands),
+        "seconds": round(seconds, 4),
+        "ops_per_sec": round(len(commands) / seconds, 1) if seconds else 0.0,
+        "commits": len(commit_latencies),
+        "aborts": len(abort_latencies),
+        "commit_latency": summarize(commit_latencies),
+        "abort_latency": summarize(abort_latencies),
+        "operation_latency": {name: summarize(values) for name, values in latencies.items() if values},
+    }
+    if track_memory:
+        report["peak_traced_bytes"] = peak_memory
+    elif resource is not None:
+        report["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return report
+
+
+def format_report(report):
+    lines = [
+        f"operations: {report['operations']}  time: {report['seconds']}s  throughput: {report['ops_per_sec']} ops/sec",
+        f"commits: {report['commits']}  aborts: {report['aborts']}",
+    ]
+    percentile_names = [f"p{p}_us" for p in PERCENTILES] + ["max_us"]
+    lines.append(f"{'latency (us)':<14}{'count':>9}" + "".join(f"{name[:-3]:>10}" for name in percentile_names))
+    rows = [("commit", report["commit_latency"]), ("abort", report["abort_latency"])]
+    rows += sorted(report["operation_latency"].items())
+    for name, summary in rows:
+        lines.append(f"{name:<14}{summary['count']:>9}" + "".join(f"{summary[key]:>10}" for key in percentile_names))
+    if "peak_traced_bytes" in report:
+        lines.append(f"peak traced memory: {report['peak_traced_bytes'] / 2 ** 20:.1f} MiB")
+    if "peak_rss_kb" in report:
+        lines.append(f"peak RSS: {report['peak_rss_kb'] / 1024:.1f} MiB")
+    return "\n".join(lines)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the TransactionManager on a trace file or a generated workload.")
+    parser.add_argument("--trace", help="run this trace file instead of generating a workload")
+    parser.add_argument("--storage", default="dict", choices=["dict", "array"])
+    parser.add_argument("--memory", action="store_true", help="trace Python allocations for peak memory (slower)")
+    parser.add_argument("--json", metavar="FILE", help="also write the report as JSON to FILE")
+    parser.add_argument("--compare", metavar="BASELINE", help="fail if throughput regressed against a JSON report")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed throughput drop for --compare")
+    add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    topology = Topology(args.sites, args.variables)
+    if args.trace:
+        commands = read_commands(args.trace)
+    else:
+        commands = (parse_line(line) for line in generator_from_args(args).lines())
+
+    report = run_benchmark(commands, topology, args.storage, args.memory)
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        floor = baseline["ops_per_sec"] * (1 - args.tolerance)
+        if report["ops_per_sec"] < floor:
+            print(f"REGRESSION: {report['ops_per_sec']} ops/sec is below {floor:.1f} "
+                  f"(baseline {baseline['ops_per_sec']} - {args.tolerance:.0%})")
+            return 1
+        print(f"OK: within {args.tolerance:.0%} of baseline {baseline['ops_per_sec']} ops/sec")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,227 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from Transaction import CommitRecord
+from TransactionManager import TransactionManager
+from WriteAheadLog import COMMIT, FAIL, RECOVER, TIME, read_log
+
+MAGIC = b"ADBCKP2\n"  # First bytes of a checkpoint file
+HEADER = struct.Struct("<qqIIqqI")  # Time, log offset, sites, variables, reclaimed transactions and records, records
+STRING_LENGTH = struct.Struct("<I")
+RECORD = struct.Struct("<qqI")  # Start time, commit time, number of writes
+SITE = struct.Struct("<IBqIII")  # Id, down, recovery time (-1 for none), failures, recoveries, down intervals
+COUNT = struct.Struct("<I")
+VERSIONS = struct.Struct("<IIq")  # Variable index, number of versions, time the history starts from
+SWAP = sys.byteorder == "big"  # Arrays are stored little-endian
+
+
+def pack_array(typecode, values):
+    packed = array(typecode, values)
+    if SWAP:
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_array(typecode, data, pos, count):
+    """Returns (array of count items read at pos, offset past them)."""
+    unpacked = array(typecode)
+    end = pos + count * unpacked.itemsize
+    unpacked.frombytes(data[pos:end])
+    if SWAP:
+        unpacked.byteswap()
+    return unpacked, end
+
+
+def write_checkpoint(tm, path):
+    """
+    Write the committed state of a TransactionManager to path: the site data, version histories and
+    failure intervals, and the commit records a down site may still need. Transactions still active
+    are not included, as they would not survive a crash either. The checkpoint records how far the
+    write-ahead log goes, so that restoring it replays only the log written after it.
+    The file is replaced atomically.
+    """
+    tm.flush_commits()
+    topology = tm.topology
+    index = topology.index
+    wal_offset = tm.wal.tell() if tm.wal is not None else 0
+    parts = [MAGIC, HEADER.pack(tm.time, wal_offset, topology.num_sites, topology.num_variables,
+                                tm.reclaimed["transactions"], tm.reclaimed["commit_records"],
+                                len(tm.committed_transactions))]
+
+    for record in tm.committed_transactions:
+        encoded = record.id.encode()
+        parts += [STRING_LENGTH.pack(len(encoded)), encoded,
+                  RECORD.pack(record.start_time, record.end_time, len(record.write_set)),
+                  pack_array("I", (index[variable] for variable in record.write_set)),
+                  pack_array("q", record.write_set.values())]
+
+    for site_id in topology.site_ids:
+        site = tm.sites[site_id]
+        parts += [SITE.pack(site_id, not site.is_up(), -1 if site.recovery_time is None else site.recovery_time,
+                            len(site.failure_history), len(site.recovery_history), len(site.down_starts)),
+                  pack_array("q", site.failure_history), pack_array("q", site.recovery_history),
+                  pack_array("q", site.down_starts), pack_array("d", site.down_ends)]
+        if site.storage == "array":
+            parts += [pack_array("q", site.data.value_array), pack_array("q", site.data.commit_time_array)]
+        else:
+            variables = topology.site_variables[site_id]
+            parts += [pack_array("q", (site.data[variable] for variable in variables)),
+                      bytes(8 * len(variables))]
+
+        store = site.commit_history
+        parts.append(COUNT.pack(len(store.times)))
+        for variable, times in store.times.items():
+            values = store.values[variable]
+            parts += [VERSIONS.pack(index[variable], len(times), store.history_start(variable)),
+                      pack_array("q", times), pack_array("q", (0 if value is None else value for value in values)),
+                      pack_array("q", store.readable[variable])]
+
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(b"".join(parts))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def load_checkpoint(tm, data):
+    """
+    Load a checkpoint held in a bytes-like buffer or mmap into a freshly initialized TransactionManager.
+    Returns the log offset it covers.
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a checkpoint")
+    topology = tm.topology
+    variables = topology.variables
+    pos = len(MAGIC)
+    (tm.time, wal_offset, num_sites, num_variables, reclaimed_transactions, reclaimed_records,
+     record_count) = HEADER.unpack_from(data, pos)
+    pos += HEADER.size
+    if (num_sites, num_variables) != (topology.num_sites, topology.num_variables):
+        raise ValueError(f"checkpoint of {num_sites} sites and {num_variables} variables does not match "
+                         f"the topology of {topology.num_sites} sites and {topology.num_variables} variables")
+    tm.reclaimed["transactions"] = reclaimed_transactions
+    tm.reclaimed["commit_records"] = reclaimed_records
+
+    for _ in range(record_count):
+        (length,) = STRING_LENGTH.unpack_from(data, pos)
+        pos += STRING_LENGTH.size
+        txn_id = bytes(data[pos:pos + length]).decode()
+        pos += length
+        start_time, end_time, count = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        indexes, pos = unpack_array("I", data, pos, count)
+        values, pos = unpack_array("q", data, pos, count)
+        write_set = {variables[i - 1]: value for i, value in zip(indexes, values)}
+        tm.committed_transactions.append(CommitRecord(txn_id, start_time, end_time, write_set))
+        tm.commit_times.append(end_time)
+
+    for _ in range(num_sites):
+        site_id, down, recovery_time, failures, recoveries, intervals = SITE.unpack_from(data, pos)
+        pos += SITE.size
+        site = tm.sites[site_id]
+        site.status = "down" if down else "up"
+        site.recovery_time = None if recovery_time < 0 else recovery_time
+        failure_history, pos = unpack_array("q", data, pos, failures)
+        recovery_history, pos = unpack_array("q", data, pos, recoveries)
+        down_starts, pos = unpack_array("q", data, pos, intervals)
+        down_ends, pos = unpack_array("d", data, pos, intervals)
+        site.failure_history = failure_history.tolist()
+        site.recovery_history = recovery_history.tolist()
+        site.down_starts = down_starts.tolist()
+        site.down_ends = down_ends.tolist()
+
+        site_variables = topology.site_variables[site_id]
+        values, pos = unpack_array("q", data, pos, len(site_variables))
+        commit_times, pos = unpack_array("q", data, pos, len(site_variables))
+        if site.storage == "array":
+            site.data.value_array = values
+            site.data.commit_time_array = commit_times
+        else:
+            site.data = dict(zip(site_variables, values.tolist()))
+
+        store = site.commit_history
+        (count,) = COUNT.unpack_from(data, pos)
+        pos += COUNT.size
+        for _ in range(count):
+            index, length, floor = VERSIONS.unpack_from(data, pos)
+            pos += VERSIONS.size
+            times, pos = unpack_array("q", data, pos, length)
+            values, pos = unpack_array("q", data, pos, length)
+            readable, pos = unpack_array("q", data, pos, length)
+            readable = readable.tolist()
+            variable = variables[index - 1]
+            store.times[variable] = times.tolist()
+            if floor:
+                store.floor[variable] = floor  # Older versions were collected
+            # A version is unreadable exactly when it is not its own latest readable version
+            store.values[variable] = [value if readable[i] == i else None for i, value in enumerate(values)]
+            store.readable[variable] = readable
+
+    tm.replica_cache.clear()
+    return wal_offset
+
+
+def replay_log(tm, data, offset=0):
+    """ Redo the records of a write-ahead log from offset on. Returns the number of records replayed. """
+    count = 0
+    resume_time = None
+    for kind, time, payload, _ in read_log(data, tm.topology, offset):
+        tm.time = time
+        if kind == COMMIT:
+            txn_id, start_time, writes = payload
+            write_set = {}
+            for variable, value, site_ids in writes:
+                for site_id in site_ids:
+                    tm.sites[site_id].write(variable, value, time)
+                write_set[variable] = value
+            tm.committed_transactions.append(CommitRecord(txn_id, start_time, time, write_set))
+            tm.commit_times.append(time)
+        elif kind == FAIL:
+            site = tm.sites[payload]
+            site.mark_down(time)
+            tm.invalidate_replicas(site)
+        elif kind == RECOVER:
+            tm.apply_recovery(tm.sites[payload])
+        if kind == TIME:
+            resume_time = time
+        else:
+            tm.retire_commits()
+            resume_time = time + 1  # The command that wrote the record has completed
+        count += 1
+    if resume_time is not None:
+        tm.time = resume_time
+    return count
+
+
+def map_file(path):
+    """ Returns a read-only mmap of a file, or None if it is missing or empty """
+    if not path or not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def restore(checkpoint_path=None, wal_path=None, topology=None, storage="dict", **options):
+    """
+    Rebuild a TransactionManager from the last checkpoint and the write-ahead log written after it,
+    memory-mapping both. Either may be missing: without a checkpoint the whole log is replayed.
+    Transactions that were active when the log ends are lost, as in a crash. options are passed on
+    to the TransactionManager.
+    """
+    tm = TransactionManager(topology, storage, **options)
+    tm.initialize_sites()
+    offset = 0
+    checkpoint = map_file(checkpoint_path)
+    if checkpoint is not None:
+        with checkpoint:
+            offset = load_checkpoint(tm, checkpoint)
+    log = map_file(wal_path)
+    if log is not None:
+        with log:
+            replay_log(tm, log, offset)
+    # Nothing is active after a restart, so only the latest versions and the history kept for queries remain
+    tm.collect_garbage()
+    return tm
@@ -0,0 +1,152 @@
+import mmap
+import struct
+import sys
+
+# Opcodes shared by the text and binary trace formats
+STRING, BEGIN, READ, WRITE, END, FAIL, RECOVER, DUMP, BEGIN_RO, QUERY, DUMP_CHANGES = range(11)
+
+OPCODES = {"begin": BEGIN, "beginRO": BEGIN_RO, "R": READ, "W": WRITE, "end": END, "fail": FAIL, "recover": RECOVER, "dump": DUMP,
+           "query": QUERY, "dumpChanges": DUMP_CHANGES}
+NAMES = {opcode: name for name, opcode in OPCODES.items()}
+
+# Argument kinds per opcode: "s" a transaction or variable name, "i" a site id or time, "v" a written value
+SIGNATURES = {BEGIN: "s", BEGIN_RO: "s", READ: "ss", WRITE: "ssv", END: "s", FAIL: "i", RECOVER: "i", DUMP: "",
+              QUERY: "sii", DUMP_CHANGES: ""}
+BINARY_KINDS = {"s": "I", "i": "I", "v": "q"}  # Names are stored as ids into the string table
+BINARY_FORMATS = {
+    opcode: struct.Struct("<" + "".join(BINARY_KINDS[kind] for kind in signature))
+    for opcode, signature in SIGNATURES.items()
+}
+STRING_LENGTH = struct.Struct("<I")
+NAME_COUNTS = {opcode: signature.count("s") for opcode, signature in SIGNATURES.items()}  # Names always come first
+
+MAGIC = b"ADBTRC1\n"  # First bytes of a binary trace
+CHUNK_SIZE = 1 << 20  # Bytes read at a time from text traces
+
+
+class TraceError(ValueError):
+    """A malformed command in a trace."""
+
+
+def parse_line(line, line_number=0):
+    """
+    Parse one line of the text command language, e.g. "W(T1, x2, 20)  // comment".
+    Returns (opcode, args) with typed arguments, or None for blank and comment-only lines.
+    """
+    comment = line.find("//")
+    if comment >= 0:
+        line = line[:comment]
+    line = line.strip()
+    if not line:
+        return None
+
+    open_paren = line.find("(")
+    close_paren = line.rfind(")")
+    if open_paren < 0 or close_paren < open_paren:
+        raise TraceError(f"line {line_number}: malformed command {line!r}")
+    opcode = OPCODES.get(line[:open_paren].strip())
+    if opcode is None:
+        raise TraceError(f"line {line_number}: unknown command {line!r}")
+
+    signature = SIGNATURES[opcode]
+    args = [arg.strip() for arg in line[open_paren + 1:close_paren].split(",")]
+    if args == [""]:
+        args = []
+    if len(args) != len(signature):
+        raise TraceError(f"line {line_number}: {NAMES[opcode]} takes {len(signature)} argument(s), got {line!r}")
+    try:
+        return opcode, tuple(arg if kind == "s" else int(arg) for kind, arg in zip(signature, args))
+    except ValueError:
+        raise TraceError(f"line {line_number}: bad argument in {line!r}") from None
+
+
+def iter_lines(stream, chunk_size=CHUNK_SIZE):
+    """Yield the lines of a text stream, reading it in large chunks."""
+    remainder = ""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        lines = (remainder + chunk).split("\n")
+        remainder = lines.pop()
+        yield from lines
+    if remainder:
+        yield remainder
+
+
+def read_text_commands(stream, chunk_size=CHUNK_SIZE):
+    """Yield (opcode, args) for every command in a text stream."""
+    for line_number, line in enumerate(iter_lines(stream, chunk_size), 1):
+        command = parse_line(line, line_number)
+        if command is not None:
+            yield command
+
+
+def read_binary_commands(data):
+    """Yield (opcode, args) for every command in a binary trace held in a bytes-like buffer or mmap."""
+    if data[:len(MAGIC)] != MAGIC:
+        raise TraceError("not a binary trace")
+    unpack_length = STRING_LENGTH.unpack_from
+    strings = []
+    pos = len(MAGIC)
+    end = len(data)
+    while pos < end:
+        opcode = data[pos]
+        pos += 1
+        if opcode == STRING:
+            (length,) = unpack_length(data, pos)
+            pos += STRING_LENGTH.size
+            strings.append(bytes(data[pos:pos + length]).decode())
+            pos += length
+            continue
+        fmt = BINARY_FORMATS[opcode]
+        values = fmt.unpack_from(data, pos)
+        pos += fmt.size
+        names = NAME_COUNTS[opcode]
+        if names == 0:
+            yield opcode, values
+        elif names == len(values):
+            yield opcode, tuple([strings[value] for value in values])
+        else:
+            yield opcode, tuple([strings[value] for value in values[:names]]) + values[names:]
+
+
+def write_binary_commands(commands, out):
+    """Write (opcode, args) commands to a binary stream, defining each name once in the string table."""
+    string_ids = {}
+    out.write(MAGIC)
+    for opcode, args in commands:
+        values = []
+        for kind, arg in zip(SIGNATURES[opcode], args):
+            if kind == "s":
+                string_id = string_ids.get(arg)
+                if string_id is None:
+                    string_id = string_ids[arg] = len(string_ids)
+                    encoded = arg.encode()
+                    out.write(bytes((STRING,)) + STRING_LENGTH.pack(len(encoded)) + encoded)
+                arg = string_id
+            values.append(arg)
+        out.write(bytes((opcode,)) + BINARY_FORMATS[opcode].pack(*values))
+
+
+def read_commands(path):
+    """
+    Yield (opcode, args) for every command of a trace file, text or binary, or of stdin when path is "-".
+    Binary files are memory-mapped, so replays skip text parsing entirely.
+    """
+    if path == "-":
+        stdin = sys.stdin.buffer
+        if hasattr(stdin, "peek") and stdin.peek(len(MAGIC))[:len(MAGIC)] == MAGIC:
+            yield from read_binary_commands(stdin.read())
+        else:
+            yield from read_text_commands(sys.stdin)
+        return
+
+    with open(path, "rb") as f:
+        is_binary = f.read(len(MAGIC)) == MAGIC
+        if is_binary:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield from read_binary_commands(data)
+            return
+    with open(path, "r", buffering=CHUNK_SIZE) as f:
+        yield from read_text_commands(f)
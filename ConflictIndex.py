@@ -0,0 +1,79 @@
+from collections import defaultdict, deque
+
+
+class ConflictIndex:
+    """
+    Inverted index from each variable to the concurrent transactions that read or wrote it.
+    Active transactions are kept in sets, committed ones in commit order so that the
+    transactions committed after a given time can be found without visiting older ones.
+    """
+
+    def __init__(self):
+        self.active_readers = defaultdict(set)  # variable -> ids of active transactions that read it
+        self.active_writers = defaultdict(set)  # variable -> ids of active transactions that wrote it
+        self.committed_readers = defaultdict(deque)  # variable -> committed readers in commit order
+        self.committed_writers = defaultdict(deque)  # variable -> committed writers in commit order
+
+    def add_read(self, txn, variable):
+        self.active_readers[variable].add(txn.id)
+
+    def add_write(self, txn, variable):
+        self.active_writers[variable].add(txn.id)
+
+    def commit(self, txn):
+        """Move a transaction from the active to the committed entries."""
+        self._discard_active(txn)
+        for variable in txn.read_set:
+            self.committed_readers[variable].append(txn)
+        for variable in txn.write_set:
+            self.committed_writers[variable].append(txn)
+
+    def discard(self, txn):
+        """Forget an active transaction. Must be called before its read and write sets are cleared."""
+        self._discard_active(txn)
+
+    def prune(self, txn):
+        """Forget a committed transaction. Transactions are pruned in commit order."""
+        self._popleft(self.committed_readers, txn.read_set, txn)
+        self._popleft(self.committed_writers, txn.write_set, txn)
+
+    def committed_readers_since(self, variable, timestamp):
+        """Yield the committed readers of variable that ended after timestamp, newest first."""
+        return self._since(self.committed_readers, variable, timestamp)
+
+    def committed_writers_since(self, variable, timestamp):
+        """Yield the committed writers of variable that ended after timestamp, newest first."""
+        return self._since(self.committed_writers, variable, timestamp)
+
+    def _discard_active(self, txn):
+        for variable in txn.read_set:
+            self._discard(self.active_readers, variable, txn.id)
+        for variable in txn.write_set:
+            self._discard(self.active_writers, variable, txn.id)
+
+    @staticmethod
+    def _discard(index, variable, txn_id):
+        txn_ids = index.get(variable)
+        if txn_ids is not None:
+            txn_ids.discard(txn_id)
+            if not txn_ids:
+                del index[variable]
+
+    @staticmethod
+    def _popleft(index, variables, txn):
+        for variable in variables:
+            txns = index.get(variable)
+            if txns and txns[0] is txn:
+                txns.popleft()
+                if not txns:
+                    del index[variable]
+
+    @staticmethod
+    def _since(index, variable, timestamp):
+        txns = index.get(variable)
+        if not txns:
+            return
+        for txn in reversed(txns):
+            if txn.end_time <= timestamp:
+                return
+            yield txn
@@ -1,44 +1,149 @@
+import argparse
+import cProfile
+import pstats
 import sys
+import time
+from CommandStream import (BEGIN, BEGIN_RO, DUMP, DUMP_CHANGES, END, FAIL, NAMES, QUERY, READ, RECOVER, WRITE, TraceError,
+                           read_commands, write_binary_commands)
+from Checkpoint import restore, write_checkpoint
+from Metrics import METRICS
+from Tracer import CATEGORIES, LEVELS, TRACE
 from TransactionManager import TransactionManager
+from WriteAheadLog import WriteAheadLog
 
-def main(input_file):
-    tm = TransactionManager()
-    tm.initialize_sites()
-
-    # Open the input file
-    with open(input_file, "r") as f:
-        for line in f:
-            line = line.strip()
-            if not line:  # Skip empty lines
-                continue
-
-            # Parse and execute commands
-            parts = line.split("(")
-            cmd = parts[0]
-            args = parts[1].rstrip(")").split(",")
-
-            if cmd == "begin":
-                tm.begin(args[0])
-            elif cmd == "R":
-                tm.read(args[0], args[1])
-            elif cmd == "W":
-                tm.write(args[0], args[1], int(args[2]))
-            elif cmd == "end":
-                tm.end(args[0])
-            elif cmd == "fail":
-                tm.fail(int(args[0]))
-            elif cmd == "recover":
-                tm.recover(int(args[0]))
-            elif cmd == "dump":
-                tm.dump()
-
-            # Increment the logical time after each command
-            tm.time += 1
+# Command dispatch table: opcode -> TransactionManager method taking the parsed arguments
+DISPATCH = {
+    BEGIN: TransactionManager.begin,
+    BEGIN_RO: TransactionManager.begin_read_only,
+    READ: TransactionManager.read,
+    WRITE: TransactionManager.write,
+    END: TransactionManager.end,
+    FAIL: TransactionManager.fail,
+    RECOVER: TransactionManager.recover,
+    DUMP: TransactionManager.dump,
+    QUERY: TransactionManager.print_query,
+    DUMP_CHANGES: TransactionManager.dump_changes,
+}
+OPERATION_METRICS = {opcode: f"operation.{NAMES[opcode]}.ns" for opcode in DISPATCH}  # Wall-clock cost histograms
+
+def run_commands(tm, commands, checkpoint_path=None, checkpoint_every=0):
+    """ Execute (opcode, args) commands, advancing the logical time after each one """
+    timed = METRICS.active
+    clock = time.perf_counter_ns
+    for count, (opcode, args) in enumerate(commands, 1):
+        if timed:
+            start = clock()
+            DISPATCH[opcode](tm, *args)
+            METRICS.observe(OPERATION_METRICS[opcode], clock() - start)
+        else:
+            DISPATCH[opcode](tm, *args)
+        tm.time += 1
+        if checkpoint_every and count % checkpoint_every == 0:
+            write_checkpoint(tm, checkpoint_path)
+
+def main(input_file, wal_path=None, checkpoint_path=None, checkpoint_every=0, resume=False, profiler=None,
+         retain_history=None, wal_sync=False):
+    """
+    Run a trace, returning the TransactionManager. A cProfile profiler, if given, runs around the dispatch loop.
+    retain_history is how long versions stay available to query commands, None for the whole run.
+    wal_sync fsyncs every write-ahead log record as it is written.
+    """
+    if resume:
+        # Continue from the state saved by an earlier run: its last checkpoint plus the log after it
+        tm = restore(checkpoint_path, wal_path, retain_history=retain_history)
+    else:
+        tm = TransactionManager(retain_history=retain_history)
+        tm.initialize_sites()
+    if wal_path:
+        tm.wal = WriteAheadLog(wal_path, tm.topology, sync=wal_sync, truncate=not resume)
+
+    # Stream the commands from the input file (text or binary), or from stdin if it is "-"
+    try:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            run_commands(tm, read_commands(input_file), checkpoint_path, checkpoint_every)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        if checkpoint_path:
+            write_checkpoint(tm, checkpoint_path)
+    finally:
+        tm.flush_commits()  # Apply the last group of commits
+        if tm.wal is not None:
+            tm.wal.log_time(tm.time)
+            tm.wal.close()
+    return tm
+
+def compile_trace(input_file, output_file):
+    """ Write the commands of a text trace to a binary trace that replays without text parsing """
+    with open(output_file, "wb") as out:
+        write_binary_commands(read_commands(input_file), out)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run a transaction trace through the TransactionManager.")
+    parser.add_argument("input_file", help="text or binary trace, or - to read from stdin")
+    parser.add_argument("--compile", metavar="OUTPUT", help="write the trace in binary form to OUTPUT instead of running it")
+    parser.add_argument("--wal", metavar="FILE", help="log commits and site events to this write-ahead log")
+    parser.add_argument("--wal-sync", action="store_true",
+                        help="fsync every write-ahead log record, so that commits survive a machine crash too")
+    parser.add_argument("--checkpoint", metavar="FILE", help="write the committed state to this checkpoint at the end")
+    parser.add_argument("--checkpoint-every", type=int, default=0, metavar="N",
+                        help="also checkpoint every N commands (requires --checkpoint)")
+    parser.add_argument("--retain-history", type=int, metavar="N",
+                        help="keep versions for query commands only N time units back, to bound memory (default: all)")
+    parser.add_argument("--resume", action="store_true",
+                        help="start from the state in --checkpoint and --wal instead of the initial state")
+    parser.add_argument("--trace", default="",
+                        help="comma separated trace categories to enable, or 'all' "
+                             f"(categories: {', '.join(CATEGORIES)})")
+    parser.add_argument("--trace-level", default="debug", choices=sorted(LEVELS))
+    parser.add_argument("--trace-format", default="text", choices=["text", "json"])
+    parser.add_argument("--trace-file", help="write trace events to this file instead of stderr")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="collect counters and histograms and write them as JSON to FILE, or to stderr if -")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="run the dispatch loop under cProfile, saving the stats to FILE and printing the top functions to stderr")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python driver.py <input_file>")
+    args = parse_args(sys.argv[1:])
+
+    if args.compile:
+        try:
+            compile_trace(args.input_file, args.compile)
+        except TraceError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
+
+    trace_file = None
+    if args.trace:
+        categories = CATEGORIES if args.trace == "all" else [c.strip() for c in args.trace.split(",") if c.strip()]
+        trace_file = open(args.trace_file, "w") if args.trace_file else None
+        TRACE.configure(categories, level=args.trace_level, stream=trace_file, fmt=args.trace_format)
+
+    if args.checkpoint_every and not args.checkpoint:
+        print("Error: --checkpoint-every requires --checkpoint", file=sys.stderr)
+        sys.exit(1)
+
+    if args.metrics:
+        METRICS.enable()
+    profiler = cProfile.Profile() if args.profile else None
+
+    try:
+        tm = main(args.input_file, args.wal, args.checkpoint, args.checkpoint_every, args.resume, profiler,
+                  args.retain_history, args.wal_sync)
+    except TraceError as e:
+        print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
-    
-    input_file = sys.argv[1]
-    main(input_file)
+
+    if args.metrics:
+        METRICS.write(tm.metrics_snapshot(), args.metrics)
+    if profiler is not None:
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(20)
+
+    TRACE.flush()
+    if trace_file:
+        trace_file.close()
@@ -0,0 +1,88 @@
+import argparse
+import asyncio
+import sys
+import time
+from Benchmark import summarize
+from Server import DEFAULT_PORT, TERMINATOR_ERROR, TERMINATOR_OK
+from WorkloadGenerator import add_arguments, generator_from_args
+
+
+async def run_client(lines, connect, window):
+    """
+    Send a client's commands over one connection, keeping up to window of them in flight.
+    Returns (latencies in ns, number of errors).
+    """
+    reader, writer = await connect()
+    in_flight = asyncio.Semaphore(window)
+    sent_at = []  # Send times of the commands awaiting their terminator, oldest first
+    latencies = []
+    errors = 0
+
+    async def receive():
+        nonlocal errors
+        received = 0
+        while received < len(lines):
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("server closed the connection")
+            line = line.decode().rstrip("\n")
+            if line == TERMINATOR_OK or line.startswith(TERMINATOR_ERROR):
+                errors += line != TERMINATOR_OK
+                latencies.append(time.perf_counter_ns() - sent_at[received])
+                received += 1
+                in_flight.release()
+
+    receiver = asyncio.ensure_future(receive())
+    for line in lines:
+        await in_flight.acquire()
+        sent_at.append(time.perf_counter_ns())
+        writer.write((line + "\n").encode())
+        if in_flight.locked():
+            await writer.drain()
+    await writer.drain()
+    await receiver
+    writer.close()
+    return latencies, errors
+
+
+async def run_load(args):
+    if args.unix:
+        def connect():
+            return asyncio.open_unix_connection(args.unix)
+    else:
+        def connect():
+            return asyncio.open_connection(args.host, args.port)
+
+    # Every client runs its own workload, with transaction ids that do not collide
+    workloads = []
+    for i in range(args.clients):
+        args.seed += 1
+        generator = generator_from_args(args)
+        generator.txn_prefix = f"C{i + 1}T"
+        workloads.append(list(generator.lines()))
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run_client(lines, connect, args.window) for lines in workloads))
+    seconds = time.perf_counter() - start
+
+    latencies = [latency for client_latencies, _ in results for latency in client_latencies]
+    commands = sum(len(lines) for lines in workloads)
+    summary = summarize(latencies)
+    print(f"clients: {args.clients}  commands: {commands}  time: {seconds:.3f}s  "
+          f"throughput: {commands / seconds:.1f} commands/sec  errors: {sum(errors for _, errors in results)}")
+    print("latency (us): " + "  ".join(f"{key[:-3]} {value}" for key, value in summary.items() if key != "count"))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Drive a Server with concurrent clients running generated workloads.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", metavar="PATH", help="connect to a Unix socket instead of TCP")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--window", type=int, default=32, help="commands each client keeps in flight")
+    add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(run_load(parse_args(sys.argv[1:])))
@@ -0,0 +1,100 @@
+import json
+import sys
+
+
+class Histogram:
+    """Count, sum and extremes of observed values, with power-of-two buckets for quantile estimates."""
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.buckets = {}  # b -> number of values v with int(v).bit_length() == b, that is 2**(b-1) <= v < 2**b
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        bucket = int(value).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def quantile(self, q):
+        """Returns an upper bound on the q quantile: the top of the bucket holding it, at most the maximum."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min((1 << bucket) - 1, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3) if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": {f"<{1 << bucket}": self.buckets[bucket] for bucket in sorted(self.buckets)},
+        }
+
+
+class Metrics:
+    """
+    Counters and histograms filled in by the transaction manager, the sites and the transactions.
+    Like trace events, call sites guard every update with `if METRICS.active`, so disabled metrics
+    cost one attribute check.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.counters = {}
+        self.histograms = {}
+
+    def enable(self):
+        self.active = True
+
+    def disable(self):
+        self.active = False
+
+    def reset(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(value)
+
+    def snapshot(self):
+        """Returns the counters and histogram summaries as a JSON-serializable dict."""
+        return {
+            "counters": {name: self.counters[name] for name in sorted(self.counters)},
+            "histograms": {name: self.histograms[name].snapshot() for name in sorted(self.histograms)},
+        }
+
+    def write(self, snapshot, path):
+        """Write a snapshot as JSON to path, or to stderr if path is "-"."""
+        if path == "-":
+            json.dump(snapshot, sys.stderr, indent=2)
+            sys.stderr.write("\n")
+        else:
+            with open(path, "w") as f:
+                json.dump(snapshot, f, indent=2)
+                f.write("\n")
+
+
+METRICS = Metrics()  # Shared by the transaction manager, the sites and the transactions
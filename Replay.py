@@ -0,0 +1,107 @@
+import argparse
+import difflib
+import io
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+import Driver
+
+DEFAULT_INPUT = os.path.join("testcases", "input")
+DEFAULT_EXPECTED = os.path.join("testcases", "output")
+
+
+def natural_key(path):
+    """ Sort key putting tc2.txt before tc10.txt """
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", path)]
+
+
+def expected_path(trace_path, expected_dir):
+    """ The expected output of tcN.txt is outN.txt, of any other trace a file of the same name """
+    name = os.path.basename(trace_path)
+    if name.startswith("tc"):
+        name = "out" + name[2:]
+    return os.path.join(expected_dir, name)
+
+
+def collect_traces(paths):
+    traces = []
+    for path in paths:
+        if os.path.isdir(path):
+            traces.extend(os.path.join(path, name) for name in os.listdir(path) if not name.startswith("."))
+        else:
+            traces.append(path)
+    return sorted(traces, key=natural_key)
+
+
+def replay(trace_path):
+    """
+    Run one trace through a fresh TransactionManager, capturing its output in memory.
+    Returns (trace path, output, seconds, error message or None).
+    """
+    out = io.StringIO()
+    start = time.perf_counter()
+    error = None
+    with redirect_stdout(out):
+        try:
+            Driver.main(trace_path)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    return trace_path, out.getvalue(), time.perf_counter() - start, error
+
+
+def compare(trace_path, output, expected_dir):
+    """ Returns (status, diff lines) for a replayed output against its expected file """
+    path = expected_path(trace_path, expected_dir)
+    if not os.path.exists(path):
+        return "new", []
+    with open(path) as f:
+        expected = f.read()
+    if output.splitlines() == expected.splitlines():
+        return "ok", []
+    diff = difflib.unified_diff(expected.splitlines(), output.splitlines(), path, trace_path + " (replayed)", lineterm="")
+    return "diff", list(diff)
+
+
+def run(traces, expected_dir, jobs=None, update=False, show_diff=False):
+    """ Replay traces in a process pool and report each one. Returns the number of failures. """
+    failures = 0
+    start = time.perf_counter()
+    chunksize = max(1, len(traces) // (4 * (jobs or os.cpu_count() or 1)))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for trace_path, output, seconds, error in pool.map(replay, traces, chunksize=chunksize):
+            if error is not None:
+                status, diff = "error", []
+            elif update:
+                os.makedirs(expected_dir, exist_ok=True)
+                with open(expected_path(trace_path, expected_dir), "w") as f:
+                    f.write(output)
+                status, diff = "updated", []
+            else:
+                status, diff = compare(trace_path, output, expected_dir)
+            if status in ("error", "diff"):
+                failures += 1
+            print(f"{status:<8}{seconds * 1000:9.2f} ms  {trace_path}" + (f"  {error}" if error else ""))
+            if show_diff:
+                for line in diff:
+                    print("    " + line)
+    print(f"{len(traces)} traces, {failures} failed, {time.perf_counter() - start:.2f}s")
+    return failures
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Replay traces in parallel and diff their output against expected files.")
+    parser.add_argument("paths", nargs="*", default=[DEFAULT_INPUT], help=f"trace files or directories (default: {DEFAULT_INPUT})")
+    parser.add_argument("--expected", default=DEFAULT_EXPECTED, help=f"directory of expected outputs (default: {DEFAULT_EXPECTED})")
+    parser.add_argument("-j", "--jobs", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--diff", action="store_true", help="print a unified diff for each mismatch")
+    parser.add_argument("--update", action="store_true", help="write the replayed outputs as the new expected files")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    failures = run(collect_traces(args.paths), args.expected, args.jobs, args.update, args.diff)
+    sys.exit(1 if failures else 0)
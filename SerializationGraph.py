@@ -0,0 +1,72 @@
+from collections import defaultdict, deque
+
+
+class SerializationGraph:
+    """
+    Serialization graph kept across commits for SSI validation.
+    An edge (a, b) means transaction a must be serialized before transaction b.
+    Committed transactions stay in the graph until no active transaction can be concurrent with them.
+    """
+
+    def __init__(self):
+        self.successors = defaultdict(set)
+        self.predecessors = defaultdict(set)
+        self.committed = deque()  # Committed transactions in commit order
+        self.committed_ids = set()
+
+    def add_edge(self, src, dst):
+        """Add the edge src -> dst."""
+        if src != dst:
+            self.successors[src].add(dst)
+            self.predecessors[dst].add(src)
+
+    def add_committed(self, txn):
+        """Keep a committed transaction in the graph."""
+        self.committed.append(txn)
+        self.committed_ids.add(txn.id)
+
+    def remove(self, txn_id):
+        """Remove a transaction and all of its edges."""
+        for dst in self.successors.pop(txn_id, ()):
+            preds = self.predecessors.get(dst)
+            if preds is not None:
+                preds.discard(txn_id)
+                if not preds:
+                    del self.predecessors[dst]
+        for src in self.predecessors.pop(txn_id, ()):
+            succs = self.successors.get(src)
+            if succs is not None:
+                succs.discard(txn_id)
+                if not succs:
+                    del self.successors[src]
+        self.committed_ids.discard(txn_id)
+
+    def prune(self, horizon):
+        """
+        Remove committed transactions that ended at or before horizon, the start time of the
+        oldest active transaction. They cannot gain new edges, so they can no longer close a cycle.
+        Returns the removed transactions in commit order.
+        """
+        pruned = []
+        while self.committed and self.committed[0].end_time <= horizon:
+            txn = self.committed.popleft()
+            self.remove(txn.id)
+            pruned.append(txn)
+        return pruned
+
+    def has_cycle(self, start_txn_id):
+        """Check whether start_txn_id can reach itself through committed transactions."""
+        stack = [dst for dst in self.successors.get(start_txn_id, ()) if dst in self.committed_ids]
+        visited = set(stack)
+        while stack:
+            txn_id = stack.pop()
+            for dst in self.successors.get(txn_id, ()):
+                if dst == start_txn_id:
+                    return True  # Cycle detected
+                if dst in self.committed_ids and dst not in visited:
+                    visited.add(dst)
+                    stack.append(dst)
+        return False
+
+    def __len__(self):
+        return len(self.committed)
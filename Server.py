@@ -0,0 +1,211 @@
+import argparse
+import asyncio
+import io
+import sys
+from contextlib import redirect_stdout
+from CommandStream import BEGIN, BEGIN_RO, END, TraceError, parse_line
+from Driver import DISPATCH
+from Topology import Topology
+from TransactionManager import TransactionManager
+
+DEFAULT_PORT = 7654
+BATCH_SIZE = 256  # Most commands executed per turn of the command loop
+QUEUE_SIZE = 4096  # Commands waiting to execute before readers stop accepting more
+TERMINATOR_OK = "OK"
+TERMINATOR_ERROR = "ERROR"
+
+
+class Client:
+    """A connection: its writer, the output gathered for it in the current batch and the transactions it began."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.output = io.StringIO()
+        self.transactions = set()
+        self.connected = True
+
+
+class OutputRouter(io.TextIOBase):
+    """Stand-in for stdout that sends what the TransactionManager prints to the client being served."""
+
+    def __init__(self):
+        self.target = None  # Client receiving output, None to discard it
+        self.touched = {}  # Clients written to since the last batch, in order
+
+    def write(self, text):
+        if self.target is not None:
+            self.target.output.write(text)
+            self.touched[self.target] = None
+        return len(text)
+
+
+class ServerTransactionManager(TransactionManager):
+    """A TransactionManager whose resumed operations report to the client that owns the transaction."""
+
+    def __init__(self, router, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.router = router
+        self.owners = {}  # txn id -> Client that began it
+
+    def resume_operations(self, txn_id, operations):
+        owner = self.owners.get(txn_id)
+        previous = self.router.target
+        self.router.target = owner if owner is not None and owner.connected else None
+        try:
+            super().resume_operations(txn_id, operations)
+        finally:
+            self.router.target = previous
+
+
+class Server:
+    """
+    Serves the Driver command language to many clients over TCP or a Unix socket.
+    Every connection reads commands as they arrive, so clients can pipeline them, and queues them for
+    a single command loop. That loop runs them in batches on one TransactionManager, advancing its
+    logical clock once per command exactly as the Driver does. Each command's printed output is sent
+    back to its client, followed by a line "OK", or "ERROR <message>" if the command failed.
+    retain_history is how long versions stay available to query commands, None for as long as the server runs.
+    """
+
+    def __init__(self, topology=None, storage="dict", batch_size=BATCH_SIZE, retain_history=None):
+        self.router = OutputRouter()
+        self.tm = ServerTransactionManager(self.router, topology, storage, retain_history=retain_history)
+        self.tm.initialize_sites()
+        self.batch_size = batch_size
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+        self.commands = 0
+        self.closing = []  # Clients that disconnected during the current batch
+
+    async def handle_client(self, reader, writer):
+        client = Client(writer)
+        line_number = 0
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line_number += 1
+                try:
+                    command = parse_line(line.decode(), line_number)
+                except TraceError as e:
+                    await self.queue.put((client, None, str(e)))  # Reported in order with the other responses
+                    continue
+                if command is not None:
+                    await self.queue.put((client, *command))
+        except ConnectionError:
+            pass
+        finally:
+            await self.queue.put((client, None, None))  # Disconnect once the commands before it have run
+
+    def execute(self, client, opcode, args):
+        """Run one command for a client, printing its output and terminator to the client."""
+        self.router.target = client
+        try:
+            DISPATCH[opcode](self.tm, *args)
+        except Exception as e:
+            print(f"{TERMINATOR_ERROR} {type(e).__name__}: {e}")
+        else:
+            if opcode == BEGIN or opcode == BEGIN_RO:
+                client.transactions.add(args[0])
+                self.tm.owners[args[0]] = client
+            elif opcode == END and not self.tm.wait_queue.is_blocked(args[0]):
+                client.transactions.discard(args[0])
+                self.tm.owners.pop(args[0], None)
+            print(TERMINATOR_OK)
+        self.tm.time += 1
+        self.commands += 1
+
+    def disconnect(self, client):
+        """
+        Abort and retire the transactions a departed client left unfinished, so they hold nothing back.
+        The connection is closed once the output of its earlier commands in the batch has been sent.
+        """
+        self.closing.append(client)
+        self.router.target = None
+        tm = self.tm
+        for txn_id in client.transactions:
+            txn = tm.transactions.get(txn_id)
+            if txn is not None and txn.status != "committed":
+                tm.wait_queue.cancel(txn_id)  # Even an aborted transaction can be waiting to read
+                if txn.is_active():
+                    tm.abort_transaction(txn, "disconnect")
+                tm.end(txn_id)
+            tm.owners.pop(txn_id, None)
+
+    async def command_loop(self):
+        queue = self.queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            with redirect_stdout(self.router):
+                for client, opcode, args in batch:
+                    if opcode is not None:
+                        self.execute(client, opcode, args)
+                    elif args is not None:  # A line that did not parse
+                        self.router.target = client
+                        print(f"{TERMINATOR_ERROR} {args}")
+                    else:
+                        self.disconnect(client)
+                self.router.target = None
+
+            # Send each client everything printed for it, including by operations a recovery resumed
+            served = self.router.touched
+            self.router.touched = {}
+            writers = []
+            for client in served:
+                if client.connected and client.output.tell():
+                    client.writer.write(client.output.getvalue().encode())
+                    writers.append(client.writer)
+                client.output.seek(0)
+                client.output.truncate()
+            for client in self.closing:
+                client.connected = False
+                client.writer.close()
+            self.closing = []
+            for writer in writers:
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    pass
+
+    async def serve(self, host="127.0.0.1", port=DEFAULT_PORT, unix_path=None):
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_client, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+        loop_task = asyncio.ensure_future(self.command_loop())
+        async with server:
+            addresses = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+            print(f"Serving on {addresses}", file=sys.stderr)
+            try:
+                await server.serve_forever()
+            finally:
+                loop_task.cancel()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Serve the transaction command language to concurrent clients.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="most commands executed per batch")
+    parser.add_argument("--storage", default="dict", choices=["dict", "array"])
+    parser.add_argument("--sites", type=int, default=10)
+    parser.add_argument("--variables", type=int, default=20)
+    parser.add_argument("--retain-history", type=int, metavar="N",
+                        help="keep versions for query commands only N time units back, to bound memory (default: all)")
+    return parser.parse_args(argv)
+
+
+async def main(args):
+    server = Server(Topology(args.sites, args.variables), args.storage, args.batch_size, args.retain_history)
+    await server.serve(args.host, args.port, args.unix)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args(sys.argv[1:])))
+    except KeyboardInterrupt:
+        pass
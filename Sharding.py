@@ -0,0 +1,222 @@
+import argparse
+import io
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from CommandStream import BEGIN, BEGIN_RO, DUMP, DUMP_CHANGES, FAIL, QUERY, READ, RECOVER, WRITE, TraceError, read_commands
+from Driver import DISPATCH, run_commands
+from Topology import Topology
+from TransactionManager import TransactionManager
+
+COORDINATOR = 0  # Shard running every command not owned by a worker
+
+# Logical clock ticks of a command run by another shard: one per command, one more where it begins or writes
+TICKS = {opcode: 2 if opcode in (BEGIN, BEGIN_RO, WRITE) else 1 for opcode in DISPATCH}
+
+
+def plan_shards(commands, topology, workers):
+    """
+    Split a trace between a coordinator and up to workers shards, each owning some isolated sites.
+    A site is isolated when it never fails or recovers and every transaction touching its non-replicated
+    variables touches nothing else: such transactions share no variable, site or failure with the rest
+    of the trace, so they validate, read and commit the same way on a TransactionManager of their own.
+    Returns (owners, shard_sites): owners[i] is the shard running command i, shard_sites[k] the sites of
+    worker shard k (shard_sites[0] is empty), or None if no site is isolated.
+    """
+    current = {}  # txn id -> its latest incarnation, an index into txn_commands
+    txn_commands = []  # Indexes of the commands of each incarnation
+    txn_sites = []  # Sites of the non-replicated variables each incarnation touches, None for any other variable
+    shared_sites = set()  # Sites that fail, recover, or serve transactions touching other sites too
+    failed_sites = set()
+    for i, (opcode, args) in enumerate(commands):
+        if opcode == BEGIN or opcode == BEGIN_RO:
+            current[args[0]] = len(txn_commands)
+            txn_commands.append([i])
+            txn_sites.append(set())
+        elif opcode == FAIL or opcode == RECOVER:
+            if opcode == RECOVER and args[0] not in failed_sites:
+                # Recovering a site that never failed replays every commit, isolated or not, and fails
+                # on the first one. Leave the trace to a single TransactionManager to report it.
+                return None
+            failed_sites.add(args[0])
+            shared_sites.add(args[0])
+        elif opcode == QUERY:
+            shared_sites.add(args[1])  # Queried on the coordinator, which must hold the site's history
+        elif opcode == DUMP_CHANGES:
+            return None  # Which variables changed depends on when every site was last dumped
+        elif opcode != DUMP:
+            txn = current.get(args[0])
+            if txn is None:
+                continue  # Unknown transaction, left to the coordinator to report
+            txn_commands[txn].append(i)
+            if opcode == READ or opcode == WRITE:
+                replicas = topology.replicas.get(args[1], ())
+                txn_sites[txn].add(replicas[0] if len(replicas) == 1 else None)
+
+    for sites in txn_sites:
+        if len(sites) > 1:
+            shared_sites.update(sites)
+    load = {}  # Isolated site -> number of commands of its transactions
+    for commands_of_txn, sites in zip(txn_commands, txn_sites):
+        if len(sites) == 1:
+            (site_id,) = sites
+            if site_id is not None and site_id not in shared_sites:
+                load[site_id] = load.get(site_id, 0) + len(commands_of_txn)
+    if not load or workers < 1:
+        return None
+
+    # Deal the sites out to the workers, the busiest first, each to the least loaded shard
+    shard_sites = [[] for _ in range(min(workers, len(load)) + 1)]
+    shard_load = [0] * len(shard_sites)
+    shard_of = {}
+    for site_id in sorted(load, key=lambda site_id: (-load[site_id], site_id)):
+        shard = min(range(1, len(shard_sites)), key=lambda k: shard_load[k])
+        shard_sites[shard].append(site_id)
+        shard_load[shard] += load[site_id]
+        shard_of[site_id] = shard
+
+    owners = array("H", bytes(2 * len(commands)))  # All COORDINATOR
+    for commands_of_txn, sites in zip(txn_commands, txn_sites):
+        if len(sites) == 1:
+            shard = shard_of.get(next(iter(sites)))
+            if shard is not None:
+                for i in commands_of_txn:
+                    owners[i] = shard
+    return owners, shard_sites
+
+
+def run_shard(shard, source, owners, shard_sites, topology, retain_history=None):
+    """
+    Run the commands a shard owns on its own TransactionManager, advancing the clock past the others.
+    source is a trace path or the list of commands. Returns (output, end offset of each owned command's
+    output, dump overlays). The coordinator's overlays hold, for each dump, the (variable, value) items of
+    the isolated sites; a worker's hold the values of its sites' non-replicated variables at each dump.
+    """
+    commands = read_commands(source) if isinstance(source, str) else source
+    tm = TransactionManager(topology, retain_history=retain_history)
+    tm.initialize_sites()
+    isolated = [site_id for sites in shard_sites for site_id in sites]
+    local_variables = {site_id: [variable for variable in topology.site_variables[site_id]
+                                 if not topology.is_replicated(variable)] for site_id in shard_sites[shard]}
+    out = io.StringIO()
+    ends = array("q")
+    dumps = {}
+    with redirect_stdout(out):
+        for i, (opcode, args) in enumerate(commands):
+            if owners[i] == shard:
+                DISPATCH[opcode](tm, *args)
+                tm.time += 1
+                ends.append(out.tell())
+                if opcode == DUMP:
+                    dumps[i] = {site_id: list(tm.sites[site_id].data.items()) for site_id in isolated}
+            else:
+                tm.time += TICKS[opcode]
+                if opcode == DUMP and local_variables:
+                    tm.flush_commits()
+                    dumps[i] = {site_id: {variable: tm.sites[site_id].data[variable] for variable in variables}
+                                for site_id, variables in local_variables.items()}
+        tm.flush_commits()
+    return out.getvalue(), ends, dumps
+
+
+def merge_outputs(owners, results, shard_sites, topology):
+    """ Interleave the outputs of the shards in command order, overlaying worker values on the dumps """
+    formatter = TransactionManager(topology)
+    positions = {site_id: n for n, site_id in enumerate(topology.site_ids)}
+    shard_of = {site_id: shard for shard, sites in enumerate(shard_sites) for site_id in sites}
+    outputs = [output for output, _, _ in results]
+    ends = [shard_ends for _, shard_ends, _ in results]
+    coordinator_dumps = results[COORDINATOR][2]
+    cursor = [0] * len(results)
+    start = [0] * len(results)
+    parts = []
+    for i, shard in enumerate(owners):
+        end = ends[shard][cursor[shard]]
+        text = outputs[shard][start[shard]:end]
+        cursor[shard] += 1
+        start[shard] = end
+        if shard == COORDINATOR and i in coordinator_dumps:
+            lines = text.split("\n")
+            for site_id, items in coordinator_dumps[i].items():
+                values = results[shard_of[site_id]][2][i][site_id]
+                items = [(variable, values.get(variable, value)) for variable, value in items]
+                lines[positions[site_id]] = formatter.format_site(site_id, True, items)  # Isolated sites never fail
+            text = "\n".join(lines)
+        parts.append(text)
+    return "".join(parts)
+
+
+def run_sharded(input_file, workers=None, topology=None, stats=None, retain_history=None):
+    """
+    Run a trace with its isolated sites split across worker processes, printing exactly what a
+    single TransactionManager would. Everything that is not isolated, including replicated and
+    multi-site transactions and every failure, recovery and dump, runs on the coordinator, which
+    sees the whole cluster as the Driver does. A trace with nothing to isolate, or one that raises
+    an error, is run on a single TransactionManager instead. stats, if given, is filled in with the
+    plan and timings. retain_history is passed on to the TransactionManagers, as by the Driver.
+    """
+    topology = topology or Topology()
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    commands = list(read_commands(input_file))
+    start = time.perf_counter()
+    plan = plan_shards(commands, topology, workers)
+    if stats is not None:
+        stats["plan_seconds"] = time.perf_counter() - start
+    if plan is None:
+        return run_single(commands, topology, stats, retain_history)
+    owners, shard_sites = plan
+
+    # Workers read a trace file themselves rather than receive the commands
+    source = commands if input_file == "-" else input_file
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=len(shard_sites)) as pool:
+            futures = [pool.submit(run_shard, shard, source, owners, shard_sites, topology, retain_history)
+                       for shard in range(len(shard_sites))]
+            results = [future.result() for future in futures]
+    except Exception:
+        return run_single(commands, topology, stats, retain_history)  # Reproduce the error where a single run would raise it
+    output = merge_outputs(owners, results, shard_sites, topology)
+    if stats is not None:
+        stats["shard_sites"] = shard_sites[1:]
+        stats["shard_commands"] = [sum(1 for owner in owners if owner == shard) for shard in range(len(shard_sites))]
+        stats["run_seconds"] = time.perf_counter() - start
+    sys.stdout.write(output)
+
+
+def run_single(commands, topology, stats=None, retain_history=None):
+    start = time.perf_counter()
+    tm = TransactionManager(topology, retain_history=retain_history)
+    tm.initialize_sites()
+    try:
+        run_commands(tm, commands)
+    finally:
+        tm.flush_commits()
+    if stats is not None:
+        stats["shard_sites"] = []
+        stats["run_seconds"] = time.perf_counter() - start
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run a trace with its isolated sites sharded across worker processes.")
+    parser.add_argument("input_file", help="text or binary trace, or - to read from stdin")
+    parser.add_argument("-j", "--workers", type=int, help="worker processes besides the coordinator (default: one per spare core)")
+    parser.add_argument("--stats", action="store_true", help="print the shard plan and timings to stderr")
+    parser.add_argument("--retain-history", type=int, metavar="N",
+                        help="keep versions for query commands only N time units back, to bound memory (default: all)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    stats = {} if args.stats else None
+    try:
+        run_sharded(args.input_file, args.workers, stats=stats, retain_history=args.retain_history)
+    except TraceError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    if stats is not None:
+        print(" ".join(f"{key}: {value}" for key, value in stats.items()), file=sys.stderr)
@@ -1,111 +1,146 @@
+from ArrayStorage import ArrayStorage
+from bisect import bisect_right
 from collections import defaultdict
+from Metrics import METRICS
+from Topology import Topology
+from Tracer import TRACE
+from VersionStore import VersionStore
+
+STORAGE_MODES = ("dict", "array")
 
 class Site:
-    def __init__(self, site_id):
+    __slots__ = ("id", "topology", "storage", "status", "data", "commit_history", "recovery_time",
+                 "failure_history", "recovery_history", "down_starts", "down_ends", "dirty")
+
+    def __init__(self, site_id, topology=None, storage="dict"):
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode {storage!r}, expected one of {STORAGE_MODES}")
         self.id = site_id
+        self.topology = topology or Topology()  # Where each variable is placed
+        self.storage = storage  # "dict", or "array" for compact typed-array storage
         self.status = "up"
         self.data = {}
-        self.commit_history = {}
+        self.commit_history = VersionStore()  # Committed versions of each variable
         self.recovery_time = None
         self.failure_history = []  # Times when the site failed
         self.recovery_history = []  # Times when the site recovered
+        # Index of down intervals [down_starts[i], down_ends[i]), kept sorted by start time.
+        # The interval of a site that is currently down is left open with an end of infinity.
+        self.down_starts = []
+        self.down_ends = []
+        self.dirty = set()  # Variables stored since the last dump
 
     def fail(self, fail_time):
         """Simulate a failure of the site."""
+        self.mark_down(fail_time)
+        print(f"Site {self.id} fails at time {fail_time}")
+
+    def mark_down(self, fail_time):
+        """Record a failure of the site at fail_time."""
+        if self.status != "down":
+            self.down_starts.append(fail_time)
+            self.down_ends.append(float('inf'))
         self.status = "down"
         self.failure_history.append(fail_time)
-        print(f"Site {self.id} fails at time {fail_time}")
 
     def initialize_data(self):
-        """ Initialize the data for 20 variables x1 to x20. """
-        for i in range(1, 21):  # Variables x1 to x20
-            variable_name = f"x{i}"
-            if i % 2 == 0:
-                # Even-indexed variables are replicated at all sites
-                self.data[variable_name] = 10 * i
-                self.commit_history[variable_name] = [(0, 10 * i)]
-            else:
-                # Odd-indexed variables are located at site 1 + (i % 10)
-                site_id_for_variable = 1 + (i % 10)
-                if self.id == site_id_for_variable:
-                    self.data[variable_name] = 10 * i
-                    self.commit_history[variable_name] = [(0, 10 * i)]
-
-    def recover(self, current_time, committed_transactions, sites_up):
-        """Simulate the recovery of the site."""
+        """ Initialize the data for the variables the topology places at this site. """
+        # A variable without committed versions holds its initial value from time 0,
+        # so the version store is only filled in by later writes
+        if self.storage == "array":
+            self.data = ArrayStorage(self.topology, self.topology.site_variables[self.id])
+            return
+        for variable_name in self.topology.site_variables[self.id]:
+            self.data[variable_name] = self.topology.initial_value(variable_name)
+
+    def recover(self, current_time, missed_commits, sites_up):
+        """
+        Simulate the recovery of the site.
+        missed_commits holds the committed transactions, in commit order, that were made
+        while the site was down, from its last failure up to and including current_time.
+        """
+        if self.status == 'down' and self.down_ends:
+            self.down_ends[-1] = current_time  # Close the open down interval
         self.status = 'up'
         self.recovery_history.append(current_time)
         self.recovery_time = current_time
-        print(f"DEBUG: Site {self.id} recovers at time {current_time}")
-
-        # Check if the site was down during the execution of any transactions
-        for txn in committed_transactions:
-            txn_commit_time = txn.end_time
-            site_failure_time = self.failure_history[-1] if self.failure_history else -1
-            site_recovery_time = self.recovery_time
-
-            # Only process writes from committed transactions that were made while the site was down, but before recovery
-            if txn_commit_time > site_failure_time and txn_commit_time <= site_recovery_time:
-                print(f"DEBUG: Site {self.id} processing writes from Transaction {txn.id} (commit time {txn_commit_time})")
-                
-                for variable, value in txn.get_committed_variables():
-                    var_index = int(variable.strip('x'))
-                    if var_index % 2 == 0:  # Replicated variable
-                        # Mark the variable as unreadable
-                        self.mark_variable_unreadable(variable)
-                    else:  # Non-replicated variable
-                        # Apply the write immediately
-                        self.apply_committed_write(txn_commit_time, variable, value)
+        if TRACE.active and TRACE.wants("site"):
+            TRACE.event("site", "recover", site=self.id, time=current_time)
+
+        # Collect the missed writes first so each replicated variable is marked once
+        unreadable_variables = {}
+        missed_writes = []
+        for txn in missed_commits:
+            if TRACE.active and TRACE.wants("recovery"):
+                TRACE.event("recovery", "missed_commit", site=self.id, txn=txn.id, commit_time=txn.end_time)
+            for variable, value in txn.get_committed_variables():
+                if self.topology.is_replicated(variable):  # Replicated variable
+                    unreadable_variables[variable] = True
+                else:  # Non-replicated variable
+                    missed_writes.append((txn.end_time, variable, value))
+
+        # Mark the replicated variables as unreadable
+        for variable in unreadable_variables:
+            self.mark_variable_unreadable(variable)
+        # Apply the non-replicated writes
+        for txn_commit_time, variable, value in missed_writes:
+            self.apply_committed_write(txn_commit_time, variable, value)
+        if METRICS.active:
+            METRICS.observe("recovery.missed_commits", len(missed_commits))
+            METRICS.observe("recovery.unreadable_variables", len(unreadable_variables))
+            METRICS.observe("recovery.replayed_writes", len(missed_writes))
+
     def is_up(self):
         """Returns True if the site is up."""
         return self.status == "up"
 
     def mark_variable_unreadable(self, variable):
         """Mark a variable as unreadable due to being accessed during failure."""
-        print(f"DEBUG: Marking {variable} as unreadable at site {self.id} due to site failure")
-        if variable in self.commit_history:
-            self.commit_history[variable].append((self.recovery_time, None))
-        else:
-            self.commit_history[variable] = [(self.recovery_time, None)]
+        if TRACE.active and TRACE.wants("recovery"):
+            TRACE.event("recovery", "mark_unreadable", site=self.id, variable=variable)
+        self.commit_history.add(variable, self.recovery_time, None)
 
 
     def apply_committed_write(self, txn_end_time, variable, value):
         """Apply the committed write for a variable after recovery."""
-        print(f"DEBUG: Attempting to apply write for {variable} = {value} at txn_end_time: {txn_end_time}, site failure history: {self.failure_history}")
 
         # Check if transaction end time is before the failure time
         if txn_end_time <= self.failure_history[-1]:  # Only apply writes if txn was committed before failure
-            if variable not in self.commit_history:
-                self.commit_history[variable] = [(txn_end_time, value)]
-            else:
-                self.commit_history[variable].append((txn_end_time, value))
+            self.commit_history.add(variable, txn_end_time, value)
 
-            self.data[variable] = value
-            print(f"DEBUG: Site {self.id} applies committed write: {variable} = {value} (txn_end_time: {txn_end_time})")
+            self.store_value(variable, value, txn_end_time)
+            if TRACE.active and TRACE.wants("recovery"):
+                TRACE.event("recovery", "apply_write", site=self.id, variable=variable, value=value, commit_time=txn_end_time)
+            if METRICS.active:
+                METRICS.count("recovery.writes_applied")
         else:
-            print(f"DEBUG: Write {variable} = {value} ignored for Site {self.id}, txn_end_time: {txn_end_time} after failure time")
+            if METRICS.active:
+                METRICS.count("recovery.writes_skipped")
+            if TRACE.active and TRACE.wants("recovery"):
+                TRACE.event("recovery", "skip_write", site=self.id, variable=variable, value=value, commit_time=txn_end_time,
+                            failure_time=self.failure_history[-1])
 
 
     def was_up_continuously_between(self, start_time, end_time):
         """Check if the site was up continuously between start_time and end_time."""
-        down_intervals = []
-        failure_times = self.failure_history[:]
-        recovery_times = self.recovery_history[:]
-
-        # If the site is currently down, add an open-ended down interval
-        if self.status == 'down':
-            failure_times.append(self.failure_history[-1])
-            recovery_times.append(float('inf'))
+        # Down intervals are disjoint and sorted, so their end times are sorted too.
+        # The first interval ending after start_time is the only candidate for an overlap.
+        i = bisect_right(self.down_ends, start_time)
+        return i == len(self.down_ends) or self.down_starts[i] >= end_time
 
-        for fail_time, recover_time in zip(failure_times, recovery_times):
-            down_intervals.append((fail_time, recover_time))
-
-        # Check for any overlap with the interval [start_time, end_time)
-        for down_start, down_end in down_intervals:
-            if down_start < end_time and down_end > start_time:
-                return False  # Site was down during the required interval
-
-        return True
+    def can_serve_read(self, variable, timestamp):
+        """
+        Check if this site's copy of variable is valid for a snapshot at timestamp, whether or not the site is up now.
+        The version visible at timestamp must be readable, and the site must have stayed up from its commit to timestamp.
+        """
+        version = self.commit_history.version_at(variable, timestamp)
+        if version is None:
+            commit_time = 0  # Initial value
+        else:
+            commit_time, value = version
+            if value is None:
+                return False  # Marked unreadable after a recovery
+        return self.was_up_continuously_between(commit_time, timestamp)
 
     def is_failed(self):
         """Returns whether the site is in a failed state."""
@@ -113,8 +148,9 @@ class Site:
 
     def get_last_commit_time(self, variable):
         """Returns the last commit time for a variable."""
-        if variable in self.commit_history and self.commit_history[variable]:
-            return self.commit_history[variable][-1][0]  # Last commit time
+        last_time = self.commit_history.last_time(variable)
+        if last_time is not None:
+            return last_time  # Last commit time
         else:
             return 0  # If no commit history, return 0 (initial value time)
         
@@ -127,12 +163,10 @@ class Site:
 
     def mark_variable_unreadable(self, variable):
         """Mark a variable as unreadable due to being accessed during failure."""
-        print(f"DEBUG: Marking {variable} as unreadable at site {self.id} due to site failure")
+        if TRACE.active and TRACE.wants("recovery"):
+            TRACE.event("recovery", "mark_unreadable", site=self.id, variable=variable)
         # We append a `None` value in commit history to mark it as unreadable
-        if variable in self.commit_history:
-            self.commit_history[variable].append((self.recovery_time, None))
-        else:
-            self.commit_history[variable] = [(self.recovery_time, None)]
+        self.commit_history.add(variable, self.recovery_time, None)
 
 
     def is_up(self):
@@ -141,19 +175,15 @@ class Site:
 
     def get_last_committed_value(self, variable, timestamp):
         """Retrieve the last committed value of a variable at or before the given timestamp."""
-        if variable not in self.commit_history:
-            return 10 * int(variable.strip().lstrip('x'))  # Return default initial value
-        
-        for commit_time, value in reversed(self.commit_history[variable]):
-            if commit_time <= timestamp and value is not None:
-                return value
+        value = self.commit_history.value_at(variable, timestamp)
+        if value is not None:
+            return value
 
-        return 10 * int(variable.strip().lstrip('x'))  # Default value if no commit found
+        return self.topology.initial_value(variable)  # Default value if no commit found
 
     def is_variable_readable(self, variable, timestamp):
         """Determine if the variable is readable based on its replication status and site failure state."""
-        var_index = int(variable.strip().lstrip('x'))
-        if var_index % 2 == 1:
+        if not self.topology.is_replicated(variable):
             # Non-replicated variable: check if the site is up
             return self.is_up()
         else:
@@ -163,8 +193,7 @@ class Site:
 
     def is_variable_writable(self, variable, transaction_start_time):
         """Determine if a variable can be written to on this site."""
-        var_index = int(variable.strip('x'))
-        if var_index % 2 == 0:  # Replicated variable
+        if self.topology.is_replicated(variable):  # Replicated variable
             # Ensure site is up and the recovery time is before transaction start
             return self.is_up() and (self.recovery_time is None or self.recovery_time <= transaction_start_time)
         return self.is_up()  # Non-replicated variables depend only on site being up
@@ -173,12 +202,56 @@ class Site:
 
     def has_failed_since(self, timestamp):
         """Returns True if the site failed after the given timestamp."""
-        return any(fail_time > timestamp for fail_time in self.failure_history)
+        return bool(self.failure_history) and self.failure_history[-1] > timestamp  # Failure times are appended in order
 
     def write(self, variable, value, timestamp):
         """Write a value for the variable at the current time."""
-        if variable in self.commit_history:
-            self.commit_history[variable].append((timestamp, value))
+        self.commit_history.add(variable, timestamp, value)
+        self.store_value(variable, value, timestamp)
+
+    def write_batch(self, writes):
+        """Write a batch of (variable, value, commit time) in commit order, storing each variable's value once."""
+        add = self.commit_history.add
+        latest = {}
+        for variable, value, timestamp in writes:
+            add(variable, timestamp, value)
+            latest[variable] = (value, timestamp)
+        for variable, (value, timestamp) in latest.items():
+            self.store_value(variable, value, timestamp)
+        if METRICS.active:
+            METRICS.count("site.writes", len(writes))
+            for variable in latest:
+                METRICS.observe("versions.length", self.commit_history.version_count(variable))
+
+    def store_value(self, variable, value, timestamp):
+        """Store the current value of a variable committed at timestamp."""
+        if self.storage == "array":
+            self.data.write(variable, value, timestamp)
+        else:
+            self.data[variable] = value
+        self.dirty.add(variable)
+
+    def take_changes(self):
+        """Returns the variables stored since the last call, in index order, and starts a new change set."""
+        if not self.dirty:
+            return []
+        changed = sorted(self.dirty, key=self.topology.index.__getitem__)
+        self.dirty = set()
+        return changed
+
+    def value_as_of(self, variable, timestamp):
+        """Returns the value the site held for the variable at timestamp: its latest readable version by then."""
+        start = self.commit_history.history_start(variable)
+        if timestamp < start:
+            raise ValueError(f"versions of {variable} at site {self.id} before time {start} have been collected")
+        return self.get_last_committed_value(variable, timestamp)
+
+    def collect_garbage(self, horizon, variables=None):
+        """Drop versions older than horizon that no snapshot can read any more. Returns the number dropped."""
+        if variables is None:
+            dropped = self.commit_history.collect_all(horizon)
         else:
-            self.commit_history[variable] = [(timestamp, value)]
-        self.data[variable] = value
+            dropped = sum(self.commit_history.collect(variable, horizon) for variable in variables)
+        if METRICS.active and dropped:
+            METRICS.count("gc.versions_dropped", dropped)
+        return dropped
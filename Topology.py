@@ -0,0 +1,43 @@
+def default_placement(index, site_ids):
+    """
+    The standard replication rule: even-indexed variables are replicated at all sites,
+    odd-indexed variables are located at site 1 + (index % number of sites).
+    """
+    if index % 2 == 0:
+        return site_ids
+    return (1 + index % len(site_ids),)
+
+
+class Topology:
+    """
+    Layout of a cluster: its sites, its variables x1..xM and the sites holding each variable.
+    Placement is computed once up front, so lookups never parse variable names.
+    placement(index, site_ids) returns the ids of the sites holding variable x<index>;
+    returning the same tuple for many variables keeps the map small.
+    """
+
+    def __init__(self, num_sites=10, num_variables=20, placement=default_placement):
+        self.num_sites = num_sites
+        self.num_variables = num_variables
+        self.site_ids = tuple(range(1, num_sites + 1))
+        self.variables = [f"x{i}" for i in range(1, num_variables + 1)]
+        self.index = {}  # variable -> index
+        self.replicas = {}  # variable -> ids of the sites holding it
+        self.replicated = {}  # variable -> True if it is held by more than one site
+        self.site_variables = {site_id: [] for site_id in self.site_ids}  # site id -> variables it holds, in index order
+
+        for i, variable in enumerate(self.variables, 1):
+            site_ids = tuple(placement(i, self.site_ids))
+            self.index[variable] = i
+            self.replicas[variable] = site_ids
+            self.replicated[variable] = len(site_ids) > 1
+            for site_id in site_ids:
+                self.site_variables[site_id].append(variable)
+
+    def is_replicated(self, variable):
+        """Returns True if the variable is held by more than one site."""
+        return self.replicated.get(variable, False)
+
+    def initial_value(self, variable):
+        """Returns the value a variable holds before any write: 10 times its index."""
+        return 10 * self.index[variable]
@@ -0,0 +1,75 @@
+import atexit
+import json
+import sys
+
+DEBUG = 10
+INFO = 20
+LEVEL_NAMES = {DEBUG: "debug", INFO: "info"}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+
+# Event categories used by the transaction manager and the sites
+CATEGORIES = ("txn", "read", "write", "commit", "validate", "site", "recovery")
+
+
+class Tracer:
+    """
+    Structured trace events with levels and categories.
+    Call sites guard every event with `if TRACE.active and TRACE.wants(category, level)`,
+    so a disabled event costs one attribute check and is never formatted.
+    Enabled events are buffered and written as text or JSON lines.
+    """
+
+    def __init__(self):
+        self.active = False  # True once any category is enabled
+        self.levels = {}  # category -> minimum level traced
+        self.stream = None
+        self.format = "text"
+        self.buffer = []
+        self.buffer_size = 1024
+        self.registered = False
+
+    def configure(self, categories=CATEGORIES, level=DEBUG, stream=None, fmt="text", buffer_size=1024):
+        """Enable the given categories at level and above. An empty list of categories disables tracing."""
+        self.flush()
+        if isinstance(level, str):
+            level = LEVELS[level]
+        self.levels = {category: level for category in categories}
+        self.active = bool(self.levels)
+        self.stream = stream
+        self.format = fmt
+        self.buffer_size = max(1, buffer_size)
+        if self.active and not self.registered:
+            atexit.register(self.flush)
+            self.registered = True
+
+    def disable(self):
+        self.configure(categories=())
+
+    def wants(self, category, level=DEBUG):
+        """Returns True if events of category at level are traced."""
+        return level >= self.levels.get(category, INFO + 1)
+
+    def event(self, category, name, level=DEBUG, **fields):
+        """Record an event. Callers check wants() first, this method does not."""
+        if self.format == "json":
+            record = {"level": LEVEL_NAMES.get(level, level), "category": category, "event": name}
+            record.update(fields)
+            line = json.dumps(record, default=str)
+        else:
+            details = " ".join(f"{key}={value}" for key, value in fields.items())
+            line = f"[{LEVEL_NAMES.get(level, level)}] {category}.{name} {details}".rstrip()
+        self.buffer.append(line)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write out the buffered events."""
+        if not self.buffer:
+            return
+        stream = self.stream or sys.stderr
+        stream.write("\n".join(self.buffer) + "\n")
+        stream.flush()
+        self.buffer.clear()
+
+
+TRACE = Tracer()  # Shared by the transaction manager, the sites and the transactions
@@ -1,7 +1,14 @@
+from Metrics import METRICS
+from Tracer import TRACE
+
+
 class Transaction:
-    def __init__(self, txn_id, start_time):
+    __slots__ = ("id", "start_time", "end_time", "read_set", "write_set", "accessed_sites", "status", "read_only")
+
+    def __init__(self, txn_id, start_time, read_only=False):
         self.id = txn_id
         self.start_time = start_time
+        self.read_only = read_only  # Declared at begin: snapshot reads only, no conflict tracking
         self.end_time = None
         self.read_set = set()
         self.write_set = {}
@@ -13,27 +20,13 @@ class Transaction:
         """Returns the write set as a list of (variable, value) pairs."""
         return list(self.write_set.items())  # Returns a list of (variable, value) pairs
 
-    def execute(self, sites, down_sites):
-        """Execute transaction on sites that are up."""
-        print(f"DEBUG: Transaction {self.id} begins at time {self.start_time}")
-        
-        # Write to only the sites that were up during the transaction execution
-        for site in sites:
-            if site.id not in down_sites:  # Only apply write if site is up during T2 execution
-                self.write_set[site.id] = {"x8": 88}  # Record T2 writes x8=88
-                site.apply_write(self.id, "x8", 88)  # Apply T2's write to x8
-                print(f"DEBUG: T2 writing x8=88 to site {site.id}")
-            else:
-                print(f"DEBUG: Site {site.id} was down during T2, skipping write")
-
-
     def check_write_read_conflict(self, other_txn):
         """ Check if self writes variables that other_txn read """
-        return any(var in self.write_set and var in other_txn.read_set for var in self.write_set)
+        return not other_txn.read_set.isdisjoint(self.write_set)
 
     def check_write_write_conflict(self, other_txn):
         """ Check if self writes variables that other_txn writes """
-        return any(var in self.write_set and var in other_txn.write_set for var in self.write_set)
+        return not self.write_set.keys().isdisjoint(other_txn.write_set)
 
     def add_read(self, variable):
         if not self.is_aborted():
@@ -41,8 +34,8 @@ class Transaction:
 
     def add_write(self, variable, value):
         if not self.is_aborted():
-            print(f"DEBUG: Transaction {self.id} writes {variable} = {value}")
-
+            if TRACE.active and TRACE.wants("write"):
+                TRACE.event("write", "buffer", txn=self.id, variable=variable, value=value)
             self.write_set[variable] = value
 
     def add_accessed_site(self, site_id):
@@ -51,10 +44,19 @@ class Transaction:
     def add_accessed_sites(self, site_ids):
         self.accessed_sites.update(site_ids)
 
+    def commit_record(self):
+        """Returns the compact summary of this transaction kept in the commit history."""
+        return CommitRecord(self.id, self.start_time, self.end_time, self.write_set)
+
     def commit(self, end_time):
         self.status = "committed"
         self.end_time = end_time
-        print(f"DEBUG: Transaction {self.id} commits at time {self.end_time}. Write set: {self.write_set}")
+        if TRACE.active and TRACE.wants("commit"):
+            TRACE.event("commit", "commit", txn=self.id, time=self.end_time, write_set=self.write_set)
+        if METRICS.active:
+            METRICS.count("transactions.committed_read_only" if self.read_only else "transactions.committed")
+            METRICS.observe("transaction.reads", len(self.read_set))
+            METRICS.observe("transaction.writes", len(self.write_set))
 
 
     def abort(self):
@@ -65,7 +67,10 @@ class Transaction:
             self.write_set.clear()
             self.accessed_sites.clear()
             print(f"Transaction {self.id} aborts")
-            print(f"DEBUG: Transaction {self.id} | Status: aborted | Action: Transaction aborted")
+            if TRACE.active and TRACE.wants("txn"):
+                TRACE.event("txn", "abort", txn=self.id)
+            if METRICS.active:
+                METRICS.count("transactions.aborted")
 
 
     def set_end_time(self, end_time):
@@ -80,4 +85,19 @@ class Transaction:
 
     def check_rw_conflict(self, other_txn):
         """ Check if there is a read-write conflict with another transaction """
-        return any(var in other_txn.write_set for var in self.read_set)
+        return not self.read_set.isdisjoint(other_txn.write_set)
+
+
+class CommitRecord:
+    """The id, times and writes of a committed transaction, kept while a failed site may still miss them."""
+    __slots__ = ("id", "start_time", "end_time", "write_set")
+
+    def __init__(self, txn_id, start_time, end_time, write_set):
+        self.id = txn_id
+        self.start_time = start_time
+        self.end_time = end_time
+        self.write_set = write_set
+
+    def get_committed_variables(self):
+        """Returns the write set as a list of (variable, value) pairs."""
+        return list(self.write_set.items())
@@ -1,238 +1,540 @@
 import time
+from bisect import bisect_right
+from collections import defaultdict, deque
+from ConflictIndex import ConflictIndex
+from SerializationGraph import SerializationGraph
 from Site import Site
+from Topology import Topology
+from WaitQueue import WaitQueue
+from Metrics import METRICS
+from Tracer import DEBUG, TRACE
 from Transaction import Transaction
 
 class TransactionManager:
-    def __init__(self):
-        self.sites = {i: Site(i) for i in range(1, 11)}  # Sites from 1 to 10
-        self.transactions = {}  # Tracks active transactions
+    def __init__(self, topology=None, storage="dict", retain_finished=0, retain_commits=0, group_commit_limit=1024,
+                 retain_history=0):
+        self.topology = topology or Topology()  # 10 sites and 20 variables unless configured otherwise
+        self.sites = {i: Site(i, self.topology, storage) for i in self.topology.site_ids}  # storage: "dict" or "array"
+        self.transactions = {}  # Active transactions and the retain_finished most recently finished ones
         self.time = 0  # Simulated time for transaction timestamps
-        self.committed_transactions = []  # List of all committed transactions
+        self.committed_transactions = []  # CommitRecords a failed site may still need, in commit order
+        self.commit_times = []  # End times of committed_transactions, in the same (time) order
+        # Transactions begun and not yet ended, in begin order, the oldest first. An aborted transaction stays
+        # until its end(), as it can still read its snapshot until then.
+        self.active_transactions = {}
+        self.serialization_graph = SerializationGraph()  # Conflict edges kept across commits
+        self.conflict_index = ConflictIndex()  # Variable -> concurrent readers and writers
+        self.replica_cache = {}  # Variable -> sites that are up and hold it, in site order
+        self.wait_queue = WaitQueue()  # Operations blocked until a site recovers
+        self.site_transactions = defaultdict(dict)  # Site id -> active transactions that accessed it, by id
+        # Retention policy: how many finished transactions to keep in self.transactions, how many commit
+        # records to keep beyond those a failed site still needs for recovery, and for how many time units
+        # past versions stay available to query() beyond those active snapshots need. None keeps everything.
+        self.retain_finished = retain_finished
+        self.retain_commits = retain_commits
+        self.retain_history = retain_history
+        self.finished = deque()  # Ids of the finished transactions still in self.transactions, in end order
+        self.reclaimed = {"transactions": 0, "commit_records": 0}  # Counts of what retirement has dropped
+        self.wal = None  # WriteAheadLog receiving commits and site events, if any
+        self.pending_commits = []  # Committed transactions whose writes have not been applied to the sites yet
+        self.group_commit_limit = group_commit_limit  # Most commits applied as one group, 1 to apply each at once
 
     def recover(self, site_id):
         """ Recover a site and reapply all committed transactions after recovery """
-        site = self.sites[site_id]
-        site.recover(self.time, self.committed_transactions, self.get_sites_up())  # Apply committed transactions after recovery
+        self.flush_commits()
+        self.apply_recovery(self.sites[site_id])
+        if self.wal is not None:
+            self.wal.log_recover(self.time, site_id)
         print(f"Site {site_id} recovers")
+        self.retire_commits()
+
+        # Resume exactly the transactions waiting on this site, in the order they blocked
+        for txn_id, operations in self.wait_queue.wake(site_id):
+            self.resume_operations(txn_id, operations)
+
+    def resume_operations(self, txn_id, operations):
+        """ Run the operations of a transaction woken from the wait queue, the blocked one first """
+        for name, args in operations:
+            getattr(self, name)(*args)
+
+    def apply_recovery(self, site):
+        """ Bring a site back up, replaying the commits it missed since its last failure """
+        failure_time = site.failure_history[-1] if site.failure_history else -1
+        missed_commits = self.commits_between(failure_time, self.time)
+        site.recover(self.time, missed_commits, self.get_sites_up())  # Apply committed transactions after recovery
+        self.invalidate_replicas(site)
 
     def initialize_sites(self):
         """ Initialize all sites with their initial data """
         for site in self.sites.values():
             site.initialize_data()
 
-    def begin(self, txn_id):
-        """ Begin a new transaction """
+    def begin(self, txn_id, read_only=False):
+        """ Begin a new transaction, or a read-only one that only reads its snapshot """
         if txn_id in self.transactions:
             raise ValueError(f"Transaction {txn_id} already exists!")
-        self.transactions[txn_id] = Transaction(txn_id, self.time)
+        self.transactions[txn_id] = Transaction(txn_id, self.time, read_only)
+        self.active_transactions[txn_id] = self.transactions[txn_id]
         print(f"Transaction {txn_id} begins")
         self.advance_time()  # Advance time after transaction begins
 
+    def begin_read_only(self, txn_id):
+        """ Begin a read-only transaction """
+        self.begin(txn_id, read_only=True)
+
     def read(self, txn_id, variable):
-        """ Read a variable in a transaction """
+        """ Read a variable in a transaction, or wait for a site that can serve it to recover """
+        self.flush_commits()
         txn = self.transactions[txn_id]
-        var_index = int(variable.strip().lstrip('x'))
+        if self.wait_queue.is_blocked(txn_id):
+            self.wait_queue.defer(txn_id, ("read", (txn_id, variable)))
+            return
 
-        if var_index % 2 == 1:  # Non-replicated variable
-            site_id = 1 + (var_index % 10)
+        if not self.topology.is_replicated(variable):  # Non-replicated variable
+            site_id = self.topology.replicas[variable][0]
             site = self.sites[site_id]
-            if site.is_up():
-                last_commit_time = site.get_last_commit_time(variable)
-                if site.was_up_continuously_between(last_commit_time, txn.start_time):
+            if site.can_serve_read(variable, txn.start_time):
+                if site.is_up():
                     value = site.get_last_committed_value(variable, txn.start_time)
-                    if value is not None:
-                        print(f"{variable}: {value}")
+                    print(f"{variable}: {value}")
+                    if not txn.read_only:
                         txn.add_read(variable)
-                        txn.add_accessed_site(site_id)
-                        return
+                        self.record_access(txn, (site_id,))
+                        self.add_read_edges(txn, variable)
                 else:
-                    print(f"Transaction {txn_id} cannot read {variable}; site {site_id} was down during required interval")
-                    txn.abort()
-                    return
+                    # The only copy is valid but its site is down: wait for it to recover
+                    print(f"Transaction {txn_id} waits for site {site_id} to read {variable}")
+                    if METRICS.active:
+                        METRICS.count("reads.waited")
+                    self.wait_queue.block(txn_id, [site_id], ("read", (txn_id, variable)))
+                return
+            elif site.is_up():
+                print(f"Transaction {txn_id} cannot read {variable}; site {site_id} was down during required interval")
+                self.abort_transaction(txn, "unreadable")
+                return
             else:
                 print(f"Transaction {txn_id} cannot read {variable}; site {site_id} is down")
-                txn.abort()
+                self.abort_transaction(txn, "unreadable")
                 return
 
         else:  # Replicated variable
-            read_successful = False
-            for site in self.sites.values():
-                if site.is_up() and variable in site.data:
-                    last_commit_time = site.get_last_commit_time(variable)
-                    if site.was_up_continuously_between(last_commit_time, txn.start_time):
-                        # Ensure we're reading the correct committed value
-                        value = site.get_last_committed_value(variable, txn.start_time)
-                        if value is not None:
-                            print(f"{variable}: {value}")  # Debugging
-                            txn.add_read(variable)
-                            txn.add_accessed_site(site.id)
-                            read_successful = True
-                            break
-            if not read_successful:
-                print(f"Transaction {txn_id} cannot read {variable}; no site has it available")
-                txn.abort()
-                self.advance_time()
+            for site in self.get_replicas_up(variable):
+                if site.can_serve_read(variable, txn.start_time):
+                    # Ensure we're reading the correct committed value
+                    value = site.get_last_committed_value(variable, txn.start_time)
+                    print(f"{variable}: {value}")
+                    if not txn.read_only:
+                        txn.add_read(variable)
+                        self.record_access(txn, (site.id,))
+                        self.add_read_edges(txn, variable)
+                    return
+
+            # No site that is up can serve the read, wait for a down site that can
+            waiting_sites = [
+                site_id for site_id in self.topology.replicas[variable]
+                if not self.sites[site_id].is_up() and self.sites[site_id].can_serve_read(variable, txn.start_time)
+            ]
+            if waiting_sites:
+                print(f"Transaction {txn_id} waits for site(s) {waiting_sites} to read {variable}")
+                if METRICS.active:
+                    METRICS.count("reads.waited")
+                self.wait_queue.block(txn_id, waiting_sites, ("read", (txn_id, variable)))
+                return
+
+            print(f"Transaction {txn_id} cannot read {variable}; no site has it available")
+            self.abort_transaction(txn, "unreadable")
+            self.advance_time()
 
     def write(self, txn_id, variable, value):
         txn = self.transactions[txn_id]
+        if self.wait_queue.is_blocked(txn_id):
+            self.wait_queue.defer(txn_id, ("write", (txn_id, variable, value)))
+            return
+        if txn.read_only:
+            raise ValueError(f"Transaction {txn_id} is read-only and cannot write {variable}")
         txn.add_write(variable, value)
+        self.add_write_edges(txn, variable)
         affected_sites = [
-            site.id for site in self.sites.values()
-            if site.is_up() and variable in site.data and site.is_variable_writable(variable, txn.start_time)
+            site.id for site in self.get_replicas_up(variable)
+            if site.is_variable_writable(variable, txn.start_time)
         ]
-        print(f"DEBUG: Write operation for {variable} = {value}, affected sites: {affected_sites}")
-        txn.add_accessed_sites(affected_sites)
-        print(f"DEBUG: Transaction {txn_id} accessed sites: {txn.accessed_sites}")
+        self.record_access(txn, affected_sites)
+        if TRACE.active and TRACE.wants("write"):
+            TRACE.event("write", "sites", txn=txn_id, variable=variable, value=value, sites=affected_sites,
+                        accessed_sites=sorted(txn.accessed_sites))
         self.advance_time()
 
 
     def end(self, txn_id):
         """ End a transaction and commit or abort it """
         txn = self.transactions[txn_id]
-        self.debug_log(f"Transaction {txn.id} | Status: {txn.status} | Action: Called end()")
+        if self.wait_queue.is_blocked(txn_id):
+            self.wait_queue.defer(txn_id, ("end", (txn_id,)))
+            return
+        if TRACE.active and TRACE.wants("txn"):
+            TRACE.event("txn", "end", txn=txn.id, status=txn.status)
         txn.set_end_time(self.time)  # Set the end time of the transaction
+        self.active_transactions.pop(txn_id, None)
+        self.forget_accesses(txn)
 
         if txn.is_aborted():
             # Transaction has already been aborted
             print(f"Transaction {txn_id} aborts")
-            self.debug_log(f"Transaction {txn.id} | Status: aborted | Action: Transaction already aborted")
+            if TRACE.active and TRACE.wants("txn"):
+                TRACE.event("txn", "already_aborted", txn=txn.id)
+            self.prune_committed()
+            self.retire_transaction(txn)
+            return
+
+        if not txn.write_set:
+            # Edges always run from a writer to a reader, so a transaction without writes has no successors
+            # in the serialization graph: it cannot close a cycle or conflict with a writer, and commits
+            # without validation. Its reads no longer constrain anyone, so it leaves the graph at once.
+            self.conflict_index.discard(txn)
+            self.serialization_graph.remove(txn.id)
+            txn.commit(self.time)
+            print(f"Transaction {txn_id} commits")
+            self.prune_committed()
+            self.retire_transaction(txn)
             return
 
         # Validate and commit transaction
-        if self.validate_transaction(txn):
+        conflict = self.validation_conflict(txn)
+        if conflict is None:
             txn.commit(self.time)
-            self.committed_transactions.append(txn)
+            self.committed_transactions.append(txn.commit_record())
+            self.commit_times.append(txn.end_time)
+            self.conflict_index.commit(txn)
+            self.add_commit_edges(txn)
+            self.serialization_graph.add_committed(txn)
+
+            # The log holds the commit before it is reported. The writes reach the sites with the next group
+            # of commits, before anything reads them.
+            if self.wal is not None:
+                self.log_commit(txn)
+            self.pending_commits.append(txn)
+            print(f"Transaction {txn_id} commits")
+            self.retire_commits()
+            if len(self.pending_commits) >= self.group_commit_limit:
+                self.flush_commits()
+        else:
+            self.abort_transaction(txn, conflict)
+            print(f"Transaction {txn_id} aborts")
+            if TRACE.active and TRACE.wants("txn"):
+                TRACE.event("txn", "validation_abort", txn=txn.id)
 
-            # Debugging: Log commit time and writes
-            self.debug_log(f"Transaction {txn.id} commits at time {self.time}. Write set: {txn.write_set}")
+        self.prune_committed()
+        self.retire_transaction(txn)
 
-            # Write the committed values to the sites
-            for variable, value in txn.write_set.items():
-                for site in self.sites.values():
-                    # Pass transaction start time to check write eligibility
-                    if site.is_up() and variable in site.data and site.is_variable_writable(variable, txn.start_time):
-                        self.debug_log(f"Transaction {txn.id} writing {variable}: {value} to site {site.id}")
-                        site.write(variable, value, self.time)
-                    else:
-                        self.debug_log(
-                            f"Transaction {txn.id} NOT writing {variable} to site {site.id} - "
-                            f"Site up: {site.is_up()}, Variable exists: {variable in site.data}, "
-                            f"Writable: {site.is_variable_writable(variable, txn.start_time)}"
-                        )
 
+    def log_commit(self, txn):
+        """
+        Log a commit with the sites each of its writes will reach. Sites cannot fail or recover while
+        commits are pending, so these are the up replicas writable since the transaction started.
+        """
+        writes = [(variable, value, [site.id for site in self.get_replicas_up(variable)
+                                     if site.is_variable_writable(variable, txn.start_time)])
+                  for variable, value in txn.write_set.items()]
+        self.wal.log_commit(txn.id, txn.start_time, txn.end_time, writes)
 
-            print(f"Transaction {txn_id} commits")
-            self.debug_log(f"Transaction {txn.id} | Status: committed | Action: Transaction committed")
-        else:
-            txn.abort()
-            print(f"Transaction {txn_id} aborts")
-            self.debug_log(f"Transaction {txn.id} | Status: aborted | Action: Transaction aborted during validation")
-
-
-    def execute_transaction(self, txn, sites_up):
-        """Execute the transaction on only the sites that are up when it starts."""
-        print(f"DEBUG: Transaction {txn.id} starts execution.")
-        for site_id in txn.sites:  # Sites where T2 is writing
-            # Only apply writes to sites that were up when the transaction began
-            if site_id in sites_up:
-                print(f"DEBUG: Transaction {txn.id} writing to Site {site_id}")
-                # Apply the write operation for the current site
-                for variable, value in txn.get_write_set():
-                    print(f"DEBUG: Transaction {txn.id} writes {variable} = {value} to Site {site_id}")
-                    site = self.sites[site_id]  # Get the site object
-                    site.apply_write(variable, value)
-            else:
-                print(f"DEBUG: Transaction {txn.id} skips Site {site_id}, site is down at transaction start.")
+    def flush_commits(self):
+        """
+        Apply the writes of the pending commits as one batch per site. Site states cannot change while
+        commits are pending, so which up replicas may take a replicated write is decided once per variable:
+        the sites recovered by a transaction's start, a prefix of the replicas in recovery time order.
+        """
+        pending = self.pending_commits
+        if not pending:
+            return
+        self.pending_commits = []
+        tracing = TRACE.active and TRACE.wants("commit")
+
+        eligibility = {}  # variable -> (up replicas in recovery time order, their recovery times)
+        batches = defaultdict(list)  # site -> [(variable, value, commit time)], in commit order
+        written = set()
+        for txn in pending:
+            for variable, value in txn.write_set.items():
+                replicas = eligibility.get(variable)
+                if replicas is None:
+                    sites = self.get_replicas_up(variable)
+                    if self.topology.is_replicated(variable):
+                        # A site that has not recovered takes every write, like one recovered at time -1
+                        sites = sorted(sites, key=lambda site: -1 if site.recovery_time is None else site.recovery_time)
+                        times = [-1 if site.recovery_time is None else site.recovery_time for site in sites]
+                    else:
+                        times = None  # Non-replicated variables can be written whenever their site is up
+                    replicas = eligibility[variable] = (sites, times)
+                sites, times = replicas
+                if times is not None:
+                    eligible = sites[:bisect_right(times, txn.start_time)]
+                else:
+                    eligible = sites
+                for site in eligible:
+                    batches[site].append((variable, value, txn.end_time))
+                if tracing:
+                    TRACE.event("commit", "write", txn=txn.id, variable=variable, value=value,
+                                sites=[site.id for site in eligible])
+                written.add(variable)
+
+        for site, writes in batches.items():
+            site.write_batch(writes)
+
+        # Versions older than every active snapshot can no longer be read
+        horizon = self.gc_horizon()
+        for site in self.sites.values():
+            site.collect_garbage(horizon, written)
+        if TRACE.active and TRACE.wants("commit"):
+            TRACE.event("commit", "flush", transactions=len(pending), sites=len(batches))
+        if METRICS.active:
+            METRICS.observe("commit_group.transactions", len(pending))
+            METRICS.observe("commit_group.sites", len(batches))
 
     def validate_transaction(self, txn):
         """
         Validates a transaction to ensure it maintains serializable snapshot isolation (SSI).
         Detects serialization anomalies involving the transaction.
         """
-        # Build edges in the serialization graph involving txn
-        serialization_edges = []
-        for other_txn in self.committed_transactions:
-            # Skip transactions that ended before txn started
-            if other_txn.end_time <= txn.start_time:
-                continue
-
-            # Check RW conflict: other_txn writes a variable read by txn
-            for variable in txn.read_set:
-                if variable in other_txn.write_set:
-                    serialization_edges.append((other_txn.id, txn.id))
-
-            # Check WR conflict: txn writes a variable read by other_txn
-            for variable in other_txn.read_set:
-                if variable in txn.write_set:
-                    serialization_edges.append((txn.id, other_txn.id))
-
-            # Check WW conflict: both transactions write to the same variable
-            for variable in txn.write_set:
-                if variable in other_txn.write_set:
-                    if txn.start_time < other_txn.end_time:
-                        # Abort txn if it conflicts with an already committed transaction
-                        self.debug_log(
-                            f"Transaction {txn.id} | Status: active | Action: WW conflict with transaction {other_txn.id} on {variable}"
-                        )
-                        return False  # Abort txn
-                    else:
-                        serialization_edges.append((txn.id, other_txn.id))
-
-        # Check for cycles in the serialization graph
-        if self.has_cycle(serialization_edges, txn.id):
-            self.debug_log(f"Transaction {txn.id} | Status: active | Action: Cycle detected in serialization graph")
-            return False
-
-        return True
-
-
-
-
-    def has_cycle(self, edges, start_txn_id):
-        from collections import defaultdict, deque
-
-        graph = defaultdict(set)
-        for src, dst in edges:
-            graph[src].add(dst)
-
-        visited = set()
-        stack = set()
-
-        def visit(txn_id):
-            if txn_id in stack:
-                return True  # Cycle detected
-            if txn_id in visited:
-                return False
-            visited.add(txn_id)
-            stack.add(txn_id)
-            for neighbor in graph[txn_id]:
-                if visit(neighbor):
-                    return True
-            stack.remove(txn_id)
-            return False
+        return self.validation_conflict(txn) is None
+
+    def validation_conflict(self, txn):
+        """ Returns why a transaction fails validation, "ww_conflict" or "cycle", or None if it passes """
+        if METRICS.active:
+            METRICS.observe("graph.committed", len(self.serialization_graph))
+            METRICS.observe("graph.nodes", len(self.serialization_graph.successors))
+        # RW and WR edges involving txn are already in the serialization graph,
+        # added as its reads and writes happened and as other transactions committed
+        ww_conflict = None
+        for variable in txn.write_set:
+            # Check WW conflict: a concurrent committed transaction wrote the same variable.
+            # Report the earliest committer, as a scan in commit order would.
+            for other_txn in self.conflict_index.committed_writers_since(variable, txn.start_time):
+                if ww_conflict is None or other_txn.end_time < ww_conflict[0].end_time:
+                    ww_conflict = (other_txn, variable)
+        if ww_conflict is not None:
+            # Abort txn if it conflicts with an already committed transaction
+            other_txn, variable = ww_conflict
+            if TRACE.active and TRACE.wants("validate"):
+                TRACE.event("validate", "ww_conflict", txn=txn.id, other=other_txn.id, variable=variable)
+            return "ww_conflict"  # Abort txn
+
+        # Check for cycles through txn in the serialization graph
+        if self.serialization_graph.has_cycle(txn.id):
+            if TRACE.active and TRACE.wants("validate"):
+                TRACE.event("validate", "cycle", txn=txn.id)
+            return "cycle"
+
+        return None
+
+    def add_read_edges(self, txn, variable):
+        """ Index a read of variable by txn and add its edges """
+        if txn.is_aborted():
+            return
+        self.conflict_index.add_read(txn, variable)
+        for other_txn in self.conflict_index.committed_writers_since(variable, txn.start_time):
+            # RW conflict: other_txn writes a variable read by txn
+            self.serialization_graph.add_edge(other_txn.id, txn.id)
 
-        return visit(start_txn_id)
+    def add_write_edges(self, txn, variable):
+        """ Index a write of variable by txn and add its edges """
+        if txn.is_aborted():
+            return
+        self.conflict_index.add_write(txn, variable)
+        for other_txn in self.conflict_index.committed_readers_since(variable, txn.start_time):
+            # WR conflict: txn writes a variable read by other_txn
+            self.serialization_graph.add_edge(txn.id, other_txn.id)
+
+    def add_commit_edges(self, txn):
+        """ Add edges between a committing transaction and the active transactions that share a variable with it """
+        for variable in txn.write_set:
+            # RW conflict: txn writes a variable read by other_txn
+            for other_id in self.conflict_index.active_readers.get(variable, ()):
+                self.serialization_graph.add_edge(txn.id, other_id)
+        for variable in txn.read_set:
+            # WR conflict: other_txn writes a variable read by txn
+            for other_id in self.conflict_index.active_writers.get(variable, ()):
+                self.serialization_graph.add_edge(other_id, txn.id)
+
+    def prune_committed(self):
+        """ Drop committed transactions that ended before every active transaction began """
+        for txn in self.serialization_graph.prune(self.snapshot_horizon()):
+            self.conflict_index.prune(txn)
+
+    def retire_transaction(self, txn):
+        """ Stop tracking a finished transaction once more than retain_finished have finished after it """
+        if self.retain_finished is None:
+            return
+        self.finished.append(txn.id)
+        while len(self.finished) > self.retain_finished:
+            txn_id = self.finished.popleft()
+            if txn_id in self.transactions and not self.transactions[txn_id].is_active():
+                del self.transactions[txn_id]
+                self.reclaimed["transactions"] += 1
+
+    def retire_commits(self):
+        """ Drop the commit records that no failed site can miss, except the retain_commits most recent """
+        if self.retain_commits is None or len(self.commit_times) <= self.retain_commits:
+            return
+        failure_times = [site.failure_history[-1] for site in self.sites.values() if not site.is_up()]
+        horizon = min(failure_times, default=self.time)  # Recovery replays only commits after the failure
+        count = min(bisect_right(self.commit_times, horizon), len(self.commit_times) - self.retain_commits)
+        if count > 0:
+            del self.committed_transactions[:count]
+            del self.commit_times[:count]
+            self.reclaimed["commit_records"] += count
 
     def fail(self, site_id):
         """ Fail a site and handle any transactions that were affected by the failure """
+        self.flush_commits()
         site = self.sites[site_id]
         site.fail(self.time)
+        self.invalidate_replicas(site)
+        if self.wal is not None:
+            self.wal.log_fail(self.time, site_id)
         print(f"Site {site_id} fails")
 
-        # Abort transactions that accessed the failed site
-        for txn in self.transactions.values():
-            if txn.is_active() and site_id in txn.accessed_sites:
-                txn.abort()
+        # Abort the active transactions that accessed the failed site, in begin order
+        affected = sorted(self.site_transactions.get(site_id, {}).values(), key=lambda txn: txn.start_time)
+        for txn in affected:
+            if txn.is_active():
+                ended = self.abort_transaction(txn, "site_failure")
                 print(f"Transaction {txn.id} aborts due to site {site_id} failure")
+                self.resume_operations(txn.id, ended)  # A blocked transaction still ends where it asked to
+
+    def get_replicas_up(self, variable):
+        """ Return the sites that are up and hold variable, in site order """
+        replicas = self.replica_cache.get(variable)
+        if replicas is None:
+            replicas = tuple(self.sites[site_id] for site_id in self.topology.replicas.get(variable, ())
+                             if self.sites[site_id].is_up())
+            self.replica_cache[variable] = replicas
+        return replicas
+
+    def invalidate_replicas(self, site):
+        """ Drop the cached replica sets of the variables held by a site that failed or recovered """
+        for variable in site.data:
+            self.replica_cache.pop(variable, None)
+
+    def commits_between(self, start_time, end_time):
+        """ Return the transactions committed after start_time and at or before end_time, in commit order """
+        lo = bisect_right(self.commit_times, start_time)
+        hi = bisect_right(self.commit_times, end_time)
+        return self.committed_transactions[lo:hi]
+
+    def record_access(self, txn, site_ids):
+        """ Note that a transaction accessed sites, indexing it under them while it is active """
+        txn.add_accessed_sites(site_ids)
+        if txn.is_active():
+            for site_id in site_ids:
+                self.site_transactions[site_id][txn.id] = txn
+
+    def forget_accesses(self, txn):
+        """ Drop a finished transaction from the site index """
+        for site_id in txn.accessed_sites:
+            accessors = self.site_transactions.get(site_id)
+            if accessors is not None:
+                accessors.pop(txn.id, None)
+                if not accessors:
+                    del self.site_transactions[site_id]
+
+    def abort_transaction(self, txn, reason="other"):
+        """
+        Abort a transaction and stop tracking it as active, counting why in the metrics. A blocked transaction
+        stops waiting, and the operations queued behind its blocked one are dropped except its end, which is
+        returned in a list of operations for the caller to run once it has reported the abort.
+        """
+        if txn.is_active():
+            self.conflict_index.discard(txn)
+            if METRICS.active:
+                METRICS.count("aborts." + reason)
+        queued = self.wait_queue.cancel(txn.id)[1:]
+        self.forget_accesses(txn)
+        txn.abort()
+        self.serialization_graph.remove(txn.id)
+        self.prune_committed()
+        return [operation for operation in queued if operation[0] == "end"]
+
+    def snapshot_horizon(self):
+        """ Return the start time of the oldest transaction not yet ended, or the current time if there is none """
+        for txn in self.active_transactions.values():
+            return txn.start_time
+        return self.time
+
+    def gc_horizon(self):
+        """ Return the time before which versions can be collected: the snapshot horizon, less retain_history """
+        if self.retain_history is None:
+            return -1  # Keep every version
+        return min(self.snapshot_horizon(), self.time - self.retain_history)
+
+    def collect_garbage(self):
+        """ Drop committed versions at every site that no active transaction can read """
+        horizon = self.gc_horizon()
+        return sum(site.collect_garbage(horizon) for site in self.sites.values())
+
+    def metrics_snapshot(self):
+        """ Returns the collected metrics together with gauges of the current state, as a JSON-serializable dict """
+        snapshot = METRICS.snapshot()
+        version_lengths = [len(times) for site in self.sites.values() for times in site.commit_history.times.values()]
+        snapshot["state"] = {
+            "time": self.time,
+            "open_transactions": len(self.active_transactions),
+            "tracked_transactions": len(self.transactions),
+            "graph_committed": len(self.serialization_graph),
+            "graph_edges": sum(len(successors) for successors in self.serialization_graph.successors.values()),
+            "commit_records": len(self.committed_transactions),
+            "pending_commits": len(self.pending_commits),
+            "waiting_transactions": len(self.wait_queue),
+            "sites_down": [site_id for site_id, site in self.sites.items() if not site.is_up()],
+            "versions": sum(version_lengths),
+            "longest_version_list": max(version_lengths, default=0),
+            "reclaimed": dict(self.reclaimed),
+        }
+        return snapshot
 
     def dump(self):
         """ Print the current state of all sites and their data """
+        self.flush_commits()
+        for site_id, site in self.sites.items():
+            site.dirty.clear()
+            print(self.format_site(site_id, site.is_up(), site.data.items()))
+
+    def dump_changes(self):
+        """ Print, as dump does, only the variables each site has stored since the previous dump """
+        self.flush_commits()
         for site_id, site in self.sites.items():
-            variables = []
-            for var in sorted(site.data.keys(), key=lambda x: int(x[1:])):  # Sort variables by index
-                if site_id == 1 or int(var[1:]) % 2 == 0 or (site.is_up() and site.data[var]):
-                    variables.append(f"{var}: {site.data[var]}")
-            print(f"Site {site_id}: " + ', '.join(variables))
+            changed = site.take_changes()
+            if changed:
+                data = site.data
+                print(self.format_site(site_id, site.is_up(), [(var, data[var]) for var in changed]))
+
+    def query(self, variable, site_id, timestamp):
+        """
+        Returns the value of variable at a site as of timestamp, served from the site's committed versions.
+        Raises ValueError if the site does not hold the variable, or if garbage collection has dropped the
+        versions needed: versions are kept while an active transaction can read them, and for retain_history
+        time units after that (all of them if retain_history is None).
+        """
+        self.flush_commits()
+        site = self.sites.get(site_id)
+        if site is None or variable not in site.data:
+            raise ValueError(f"Site {site_id} does not hold {variable}")
+        return site.value_as_of(variable, timestamp)
+
+    def print_query(self, variable, site_id, timestamp):
+        """ Print the value of variable at a site as of timestamp, or why it cannot be known """
+        try:
+            value = self.query(variable, site_id, timestamp)
+        except ValueError as e:
+            print(f"Cannot query {variable} at site {site_id} as of {timestamp}: {e}")
+            return
+        print(f"{variable} at site {site_id} as of {timestamp}: {value}")
+
+    def format_site(self, site_id, up, items):
+        """ The dump line of a site that is up or down and holds the (variable, value) items, in index order """
+        variables = []
+        for var, value in items:
+            if site_id == 1 or self.topology.is_replicated(var) or (up and value):
+                variables.append(f"{var}: {value}")
+        return f"Site {site_id}: " + ', '.join(variables)
 
     def advance_time(self):
         """ Simulate the passage of time """
@@ -243,5 +545,6 @@ class TransactionManager:
         return [site_id for site_id, site in self.sites.items() if site.is_up()]
 
     def debug_log(self, message):
-        """ Print debug logs """
-        print(message)
+        """ Record a free-form debug message in the trace """
+        if TRACE.active and TRACE.wants("txn", DEBUG):
+            TRACE.event("txn", "log", message=message)
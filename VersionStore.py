@@ -0,0 +1,107 @@
+from bisect import bisect_right
+
+
+class VersionStore:
+    """Timestamp-ordered committed versions of the variables held by a site."""
+
+    def __init__(self):
+        self.times = {}  # variable -> sorted list of commit times
+        self.values = {}  # variable -> values parallel to times, None marks an unreadable version
+        # variable -> for each version, the index of the latest readable version at or before it (-1 if none)
+        self.readable = {}
+        self.floor = {}  # variable -> earliest time its versions are complete from, once older ones are collected
+
+    def __contains__(self, variable):
+        return variable in self.times
+
+    def add(self, variable, timestamp, value):
+        """Record a version of the variable committed at the given timestamp."""
+        times = self.times.get(variable)
+        if times is None:
+            self.times[variable] = [timestamp]
+            self.values[variable] = [value]
+            self.readable[variable] = [-1 if value is None else 0]
+            return
+
+        values = self.values[variable]
+        readable = self.readable[variable]
+        if timestamp >= times[-1]:
+            # Commits arrive in time order, so this is the common case
+            times.append(timestamp)
+            values.append(value)
+            readable.append(readable[-1] if value is None else len(values) - 1)
+            return
+
+        # Out of order version: insert it and rebuild the readable index from there
+        pos = bisect_right(times, timestamp)
+        times.insert(pos, timestamp)
+        values.insert(pos, value)
+        readable.insert(pos, -1)
+        for i in range(pos, len(values)):
+            if values[i] is not None:
+                readable[i] = i
+            else:
+                readable[i] = readable[i - 1] if i > 0 else -1
+
+    def last_time(self, variable):
+        """Returns the time of the latest version of the variable, or None if it has no versions."""
+        times = self.times.get(variable)
+        return times[-1] if times else None
+
+    def value_at(self, variable, timestamp):
+        """Returns the latest readable value committed at or before timestamp, or None if there is none."""
+        times = self.times.get(variable)
+        if not times:
+            return None
+        i = bisect_right(times, timestamp) - 1
+        if i < 0:
+            return None
+        j = self.readable[variable][i]
+        return self.values[variable][j] if j >= 0 else None
+
+    def version_at(self, variable, timestamp):
+        """Returns the (time, value) of the latest version at or before timestamp, unreadable or not, or None."""
+        times = self.times.get(variable)
+        if not times:
+            return None
+        i = bisect_right(times, timestamp) - 1
+        if i < 0:
+            return None
+        return times[i], self.values[variable][i]
+
+    def history_start(self, variable):
+        """Returns the earliest timestamp the versions kept can answer for, 0 if none have been collected."""
+        return self.floor.get(variable, 0)
+
+    def version_count(self, variable):
+        """Returns the number of versions kept for the variable."""
+        return len(self.times.get(variable, ()))
+
+    def collect(self, variable, horizon):
+        """
+        Drop versions that no snapshot at or after horizon can observe.
+        The latest version at or before horizon is kept, and so is the latest readable one before it.
+        Returns the number of versions dropped.
+        """
+        times = self.times.get(variable)
+        if not times:
+            return 0
+        last = bisect_right(times, horizon) - 1
+        if last < 0:
+            return 0
+        readable = self.readable[variable]
+        cut = readable[last] if readable[last] >= 0 else last
+        if cut <= 0:
+            return 0
+
+        del times[:cut]
+        del self.values[variable][:cut]
+        del readable[:cut]
+        self.floor[variable] = times[0]
+        for i, j in enumerate(readable):
+            readable[i] = j - cut if j >= 0 else -1
+        return cut
+
+    def collect_all(self, horizon):
+        """Run collect for every variable. Returns the number of versions dropped."""
+        return sum(self.collect(variable, horizon) for variable in list(self.times))
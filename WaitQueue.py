@@ -0,0 +1,51 @@
+from collections import defaultdict
+
+
+class WaitQueue:
+    """
+    Operations blocked until a site recovers.
+    A blocked transaction has one waiting operation, indexed under every site whose recovery
+    could serve it. Operations the transaction issues while blocked are queued behind it,
+    so that they run in order once it is woken.
+    """
+
+    def __init__(self):
+        self.by_site = defaultdict(dict)  # site id -> ids of the transactions waiting on it, in blocking order
+        self.sites = {}  # txn id -> ids of the sites it waits on
+        self.operations = {}  # txn id -> [(method name, args)], the blocked operation first
+
+    def block(self, txn_id, site_ids, operation):
+        """Park a transaction's operation until one of site_ids recovers."""
+        self.sites[txn_id] = tuple(site_ids)
+        self.operations[txn_id] = [operation]
+        for site_id in site_ids:
+            self.by_site[site_id][txn_id] = None
+
+    def is_blocked(self, txn_id):
+        return txn_id in self.operations
+
+    def defer(self, txn_id, operation):
+        """Queue an operation behind a blocked transaction."""
+        self.operations[txn_id].append(operation)
+
+    def wake(self, site_id):
+        """Unblock the transactions waiting on a site. Returns [(txn id, operations)] in blocking order."""
+        woken = []
+        for txn_id in self.by_site.pop(site_id, ()):
+            woken.append((txn_id, self.operations[txn_id]))
+            self.cancel(txn_id)
+        return woken
+
+    def cancel(self, txn_id):
+        """Forget a transaction's waiting and queued operations. Returns them, the blocked one first."""
+        operations = self.operations.pop(txn_id, [])
+        for site_id in self.sites.pop(txn_id, ()):
+            waiting = self.by_site.get(site_id)
+            if waiting is not None:
+                waiting.pop(txn_id, None)
+                if not waiting:
+                    del self.by_site[site_id]
+        return operations
+
+    def __len__(self):
+        return len(self.operations)
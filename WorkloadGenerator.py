@@ -0,0 +1,141 @@
+import argparse
+import random
+import sys
+from bisect import bisect_left
+from itertools import accumulate
+from Topology import Topology
+
+
+class ZipfSampler:
+    """Draws ranks 0..n-1 with probability proportional to 1 / (rank + 1) ** skew. A skew of 0 is uniform."""
+
+    def __init__(self, n, skew, rng):
+        self.rng = rng
+        self.cumulative = list(accumulate(1.0 / (rank ** skew) for rank in range(1, n + 1)))
+        self.total = self.cumulative[-1] if self.cumulative else 0.0
+
+    def sample(self):
+        return bisect_left(self.cumulative, self.rng.random() * self.total)
+
+
+class WorkloadGenerator:
+    """
+    Seeded generator of synthetic traces in the Driver command language.
+    Transactions are interleaved up to a concurrency limit, each issuing a random number of
+    reads and writes over keys drawn with Zipf skew, split between replicated and
+    non-replicated variables. A read_only_share of the transactions are declared read-only
+    with beginRO and only read. Sites fail and recover at the given per-command rates.
+    """
+
+    def __init__(self, seed=0, transactions=1000, ops_per_transaction=4, read_ratio=0.5, skew=0.0,
+                 replicated_share=0.5, fail_rate=0.0, recover_rate=0.0, concurrency=8, topology=None,
+                 read_only_share=0.0, txn_prefix="T"):
+        self.rng = random.Random(seed)
+        self.transactions = transactions
+        self.ops_per_transaction = ops_per_transaction
+        self.read_ratio = read_ratio
+        self.replicated_share = replicated_share
+        self.read_only_share = read_only_share
+        self.txn_prefix = txn_prefix  # Transaction ids are the prefix and a sequence number
+        self.fail_rate = fail_rate
+        self.recover_rate = recover_rate
+        self.concurrency = max(1, concurrency)
+        self.topology = topology or Topology()
+
+        replicated = [v for v in self.topology.variables if self.topology.is_replicated(v)]
+        local = [v for v in self.topology.variables if not self.topology.is_replicated(v)]
+        # Shuffle so that the hottest keys are not always the lowest indexes
+        self.rng.shuffle(replicated)
+        self.rng.shuffle(local)
+        self.pools = [(pool, ZipfSampler(len(pool), skew, self.rng)) for pool in (replicated, local)]
+
+    def pick_variable(self):
+        replicated, local = self.pools
+        choice = replicated if self.rng.random() < self.replicated_share else local
+        if not choice[0]:  # The topology has no variables of that kind
+            choice = local if choice is replicated else replicated
+        pool, sampler = choice
+        return pool[sampler.sample()]
+
+    def lines(self):
+        """Yield the lines of the trace."""
+        rng = self.rng
+        active = []  # [txn id, operations left, read-only]
+        began = 0
+        down_sites = []
+        up_sites = list(self.topology.site_ids)
+
+        while began < self.transactions or active:
+            if self.fail_rate and len(up_sites) > 1 and rng.random() < self.fail_rate:
+                site_id = up_sites.pop(rng.randrange(len(up_sites)))
+                down_sites.append(site_id)
+                yield f"fail({site_id})"
+            if self.recover_rate and down_sites and rng.random() < self.recover_rate:
+                site_id = down_sites.pop(rng.randrange(len(down_sites)))
+                up_sites.append(site_id)
+                yield f"recover({site_id})"
+
+            if began < self.transactions and (not active or (len(active) < self.concurrency and rng.random() < 0.5)):
+                began += 1
+                read_only = bool(self.read_only_share) and rng.random() < self.read_only_share
+                txn_id = f"{self.txn_prefix}{began}"
+                active.append([txn_id, max(1, round(rng.expovariate(1.0 / self.ops_per_transaction))), read_only])
+                yield f"beginRO({txn_id})" if read_only else f"begin({txn_id})"
+                continue
+
+            entry = active[rng.randrange(len(active))]
+            txn_id = entry[0]
+            if entry[1] == 0:
+                active.remove(entry)
+                yield f"end({txn_id})"
+                continue
+            entry[1] -= 1
+            variable = self.pick_variable()
+            if entry[2] or rng.random() < self.read_ratio:
+                yield f"R({txn_id},{variable})"
+            else:
+                yield f"W({txn_id},{variable},{rng.randint(1, 9999)})"
+
+    def write(self, out):
+        for line in self.lines():
+            out.write(line + "\n")
+
+
+def add_arguments(parser):
+    """ Add the workload options to an argument parser """
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--transactions", type=int, default=1000)
+    parser.add_argument("--ops", type=float, default=4, help="mean reads and writes per transaction")
+    parser.add_argument("--read-ratio", type=float, default=0.5, help="share of operations that are reads")
+    parser.add_argument("--skew", type=float, default=0.0, help="Zipf exponent of key popularity (0 = uniform)")
+    parser.add_argument("--replicated-share", type=float, default=0.5, help="share of accesses to replicated variables")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="probability of a site failure per command")
+    parser.add_argument("--recover-rate", type=float, default=0.0, help="probability of a site recovery per command")
+    parser.add_argument("--read-only-share", type=float, default=0.0, help="share of transactions declared read-only")
+    parser.add_argument("--concurrency", type=int, default=8, help="maximum concurrently active transactions")
+    parser.add_argument("--sites", type=int, default=10)
+    parser.add_argument("--variables", type=int, default=20)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Generate a synthetic trace for Driver.py.")
+    parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def generator_from_args(args):
+    return WorkloadGenerator(seed=args.seed, transactions=args.transactions, ops_per_transaction=args.ops,
+                             read_ratio=args.read_ratio, skew=args.skew, replicated_share=args.replicated_share,
+                             fail_rate=args.fail_rate, recover_rate=args.recover_rate, concurrency=args.concurrency,
+                             topology=Topology(args.sites, args.variables), read_only_share=args.read_only_share)
+
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    generator = generator_from_args(args)
+    if args.output:
+        with open(args.output, "w") as out:
+            generator.write(out)
+    else:
+        generator.write(sys.stdout)
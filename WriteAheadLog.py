@@ -0,0 +1,144 @@
+import os
+import struct
+
+# Record kinds
+COMMIT, FAIL, RECOVER, TIME = range(1, 5)
+
+MAGIC = b"ADBWAL1\n"  # First bytes of a log file
+HEADER = struct.Struct("<Bq")  # Record kind, time
+STRING_LENGTH = struct.Struct("<I")
+COMMIT_FIELDS = struct.Struct("<qI")  # Transaction start time, number of writes
+WRITE_FIELDS = struct.Struct("<IqI")  # Variable index, value, number of sites written
+SITE_ID = struct.Struct("<I")
+
+
+class WriteAheadLog:
+    """
+    Append-only log of the committed writes and site failures and recoveries of a TransactionManager.
+    Commits record the exact sites each value was written to, so replaying the log redoes them without
+    re-evaluating which replicas were eligible. Offsets into the log identify the position a checkpoint covers.
+    Records are handed to the operating system as they are appended, so they outlive a crash of the process;
+    with sync they are also fsynced, so they outlive a crash of the machine.
+    """
+
+    def __init__(self, path, topology, sync=False, truncate=False):
+        self.path = path
+        self.topology = topology
+        self.sync = sync  # fsync after every record, instead of leaving it to flush() and close()
+        if not truncate:
+            discard_torn_tail(path, topology)
+        self.file = open(path, "wb" if truncate else "ab", buffering=0)  # Append unless starting a new history
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    def append(self, record):
+        self.file.write(record)
+        if self.sync:
+            self.flush()
+
+    def log_commit(self, txn_id, start_time, commit_time, writes):
+        """Log a commit. writes holds (variable, value, ids of the sites written) triples."""
+        encoded = txn_id.encode()
+        parts = [HEADER.pack(COMMIT, commit_time), STRING_LENGTH.pack(len(encoded)), encoded,
+                 COMMIT_FIELDS.pack(start_time, len(writes))]
+        index = self.topology.index
+        for variable, value, site_ids in writes:
+            parts.append(WRITE_FIELDS.pack(index[variable], value, len(site_ids)))
+            parts.append(struct.pack(f"<{len(site_ids)}I", *site_ids))
+        self.append(b"".join(parts))
+
+    def log_fail(self, time, site_id):
+        self.append(HEADER.pack(FAIL, time) + SITE_ID.pack(site_id))
+
+    def log_recover(self, time, site_id):
+        self.append(HEADER.pack(RECOVER, time) + SITE_ID.pack(site_id))
+
+    def log_time(self, time):
+        """Log the logical time reached, so that a restart resumes the clock exactly where it stopped."""
+        self.append(HEADER.pack(TIME, time))
+
+    def tell(self):
+        """Returns the offset just past the last record."""
+        return self.file.tell()
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+def discard_torn_tail(path, topology):
+    """
+    Cut an existing log back to its last complete record, so that records appended after a crash
+    follow it directly instead of the torn bytes of the record the crash interrupted.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        data = f.read()
+    length = len(MAGIC) if len(data) >= len(MAGIC) else 0  # Rewrite a header the crash cut short
+    for _, _, _, length in read_log(data, topology):
+        pass
+    if length < len(data):
+        os.truncate(path, length)
+
+
+def read_log(data, topology, offset=0):
+    """
+    Yield (kind, time, payload, end offset) for each complete record of a log held in a bytes-like buffer or mmap,
+    starting at offset (0 for the beginning of the log). The payload of a commit is
+    (txn id, start time, [(variable, value, site ids)]), that of a failure or recovery the site id,
+    and that of a time record None.
+    A record cut short by a crash ends the log. A record naming a variable or site the topology does not
+    have raises ValueError.
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        if len(data) < len(MAGIC) and MAGIC.startswith(bytes(data)):
+            return  # Torn before the header was complete: an empty log
+        raise ValueError("not a write-ahead log")
+    pos = max(offset, len(MAGIC))
+    end = len(data)
+    variables = topology.variables
+    num_sites = topology.num_sites
+    try:
+        while pos < end:
+            start = pos
+            kind, time = HEADER.unpack_from(data, pos)
+            pos += HEADER.size
+            if kind == COMMIT:
+                (length,) = STRING_LENGTH.unpack_from(data, pos)
+                pos += STRING_LENGTH.size
+                if pos + length > end:
+                    return
+                txn_id = bytes(data[pos:pos + length]).decode()
+                pos += length
+                start_time, count = COMMIT_FIELDS.unpack_from(data, pos)
+                pos += COMMIT_FIELDS.size
+                writes = []
+                for _ in range(count):
+                    index, value, site_count = WRITE_FIELDS.unpack_from(data, pos)
+                    pos += WRITE_FIELDS.size
+                    if not 1 <= index <= len(variables) or site_count > num_sites:
+                        raise ValueError(f"corrupt write-ahead log record at offset {start}")
+                    site_ids = struct.unpack_from(f"<{site_count}I", data, pos)
+                    pos += 4 * site_count
+                    if not all(1 <= site_id <= num_sites for site_id in site_ids):
+                        raise ValueError(f"corrupt write-ahead log record at offset {start}")
+                    writes.append((variables[index - 1], value, site_ids))
+                yield COMMIT, time, (txn_id, start_time, writes), pos
+            elif kind in (FAIL, RECOVER):
+                (site_id,) = SITE_ID.unpack_from(data, pos)
+                pos += SITE_ID.size
+                if not 1 <= site_id <= num_sites:
+                    raise ValueError(f"corrupt write-ahead log record at offset {start}")
+                yield kind, time, site_id, pos
+            elif kind == TIME:
+                yield kind, time, None, pos
+            else:
+                raise ValueError(f"corrupt write-ahead log record at offset {start}")
+    except struct.error:
+        return  # Torn final record